@@ -0,0 +1,86 @@
+from typing import List, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Metodi consentiti nelle risposte di preflight
+CORS_ALLOWED_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+CORS_MAX_AGE_SECONDS = 600
+
+
+class SimpleCORSMiddleware:
+    """
+    Middleware CORS ASGI minimale per un'API aperta a tutte le origini
+
+    Equivale a CORSMiddleware con allow_origins, allow_methods e allow_headers
+    impostati a "*", ma con header precalcolati una sola volta: nessun controllo
+    sulle liste di origini, metodi e header ad ogni richiesta.
+    """
+
+    def __init__(self, app: ASGIApp, allow_credentials: bool = True, max_age: int = CORS_MAX_AGE_SECONDS):
+        """
+        Inizializza il middleware
+
+        Args:
+            app: Applicazione ASGI da avvolgere
+            allow_credentials: Se consentire l'invio di cookie e credenziali
+            max_age: Durata in secondi della cache del preflight nel browser
+        """
+        self.app = app
+        self.allow_credentials = allow_credentials
+
+        # Con le credenziali il browser non accetta "*": si rimanda l'origine della richiesta
+        self.extra_headers: List[Tuple[bytes, bytes]] = [(b"vary", b"Origin")] if allow_credentials else []
+        if allow_credentials:
+            self.extra_headers.append((b"access-control-allow-credentials", b"true"))
+
+        self.preflight_headers: List[Tuple[bytes, bytes]] = [
+            *self.extra_headers,
+            (b"access-control-allow-methods", CORS_ALLOWED_METHODS),
+            (b"access-control-max-age", str(max_age).encode("latin-1")),
+            (b"content-length", b"0"),
+        ]
+
+    def _origin_header(self, origin: bytes) -> Tuple[bytes, bytes]:
+        """Header Access-Control-Allow-Origin per l'origine della richiesta"""
+        return (b"access-control-allow-origin", origin if self.allow_credentials else b"*")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Un solo passaggio sugli header della richiesta
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        # Richiesta non cross-origin: nessun header da aggiungere
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Preflight: risposta diretta senza passare per l'applicazione
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            headers = [self._origin_header(origin), *self.preflight_headers]
+            if request_headers is not None:
+                headers.append((b"access-control-allow-headers", request_headers))
+
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cors_headers = [self._origin_header(origin), *self.extra_headers]
+
+        async def send_with_cors(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *cors_headers]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
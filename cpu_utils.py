@@ -0,0 +1,54 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+# Limiti di CPU del container: cgroup v2 e, in alternativa, cgroup v1
+_CGROUP_V2_CPU_MAX = Path("/sys/fs/cgroup/cpu.max")
+_CGROUP_V1_CPU_QUOTA = Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+_CGROUP_V1_CPU_PERIOD = Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+
+
+def _cgroup_cpu_limit() -> Optional[int]:
+    """Numero di CPU concesse dalla quota cgroup, None se non c'è una quota"""
+    try:
+        if _CGROUP_V2_CPU_MAX.is_file():
+            quota, period = _CGROUP_V2_CPU_MAX.read_text().split()
+            if quota == "max":
+                return None
+        else:
+            quota = _CGROUP_V1_CPU_QUOTA.read_text().strip()
+            period = _CGROUP_V1_CPU_PERIOD.read_text().strip()
+            if int(quota) <= 0:
+                return None
+    except (OSError, ValueError):
+        return None
+
+    return max(1, int(quota) // int(period))
+
+
+def available_cpus() -> int:
+    """
+    Restituisce le CPU effettivamente utilizzabili dal processo
+
+    os.cpu_count() e nproc riportano le CPU dell'host: qui si tiene conto
+    anche dell'affinità del processo e della quota CPU del container.
+
+    Returns:
+        Numero di CPU disponibili, almeno 1
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity non esiste su macOS e Windows
+        cpus = os.cpu_count() or 1
+
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, limit)
+
+    return max(1, cpus)
+
+
+if __name__ == "__main__":
+    # Usato dagli script di avvio per il default di WEB_CONCURRENCY
+    print(available_cpus())
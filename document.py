@@ -1,8 +1,9 @@
 from pydantic import BaseModel, Field, validator
-from typing import List, Dict, Any, Optional, Literal
+from typing import Annotated, List, Dict, Any, Optional, Literal
 from enum import Enum
 from datetime import datetime
-import uuid
+
+from app.utils.id_utils import new_id
 
 
 class DocumentType(str, Enum):
@@ -13,6 +14,13 @@ class DocumentType(str, Enum):
     ANALISI_MERCATO = "analisi_mercato"
     SCONOSCIUTO = "sconosciuto"
 
+    @classmethod
+    def from_value(cls, value: Any) -> "DocumentType":
+        """Converte un valore in DocumentType con un lookup diretto, SCONOSCIUTO se non valido"""
+        if not isinstance(value, str):
+            return cls.SCONOSCIUTO
+        return cls._value2member_map_.get(value, cls.SCONOSCIUTO)
+
 
 class FileType(str, Enum):
     PDF = "pdf"
@@ -24,7 +32,7 @@ class FileType(str, Enum):
 
 class DocumentMetadata(BaseModel):
     original_filename: str
-    file_type: FileType
+    file_type: Optional[FileType] = Field(None, description="Tipo di file, None se non supportato")
     file_size: int = Field(..., description="Dimensione del file in bytes")
     pages_processed: int = Field(1, description="Numero di pagine processate")
     processing_time_ms: Optional[int] = None
@@ -32,63 +40,86 @@ class DocumentMetadata(BaseModel):
 
 
 class ProcessingRequest(BaseModel):
-    document_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    document_id: str = Field(default_factory=new_id)
     document_type_hint: Optional[DocumentType] = None
     custom_metadata: Optional[Dict[str, Any]] = None
 
 
+# Tipi condivisi dai modelli dei dati estratti: tutti i campi sono opzionali
+OptStr = Annotated[Optional[str], Field(default=None)]
+OptFloat = Annotated[Optional[float], Field(default=None)]
+OptStrMap = Annotated[Optional[Dict[str, str]], Field(default=None)]
+OptFloatMap = Annotated[Optional[Dict[str, float]], Field(default=None)]
+OptAnyMap = Annotated[Optional[Dict[str, Any]], Field(default=None)]
+OptRecordList = Annotated[Optional[List[Dict[str, Any]]], Field(default=None)]
+OptStrList = Annotated[Optional[List[str]], Field(default=None)]
+
+
 class FatturaData(BaseModel):
-    numero_fattura: Optional[str] = None
-    data_fattura: Optional[str] = None
-    importo_totale: Optional[float] = None
-    iva: Optional[float] = None
-    mittente: Optional[Dict[str, str]] = None
-    destinatario: Optional[Dict[str, str]] = None
-    righe_fattura: Optional[List[Dict[str, Any]]] = None
+    numero_fattura: OptStr
+    data_fattura: OptStr
+    importo_totale: OptFloat
+    iva: OptFloat
+    mittente: OptStrMap
+    destinatario: OptStrMap
+    righe_fattura: OptRecordList
     valuta: Optional[str] = "EUR"
 
 
 class BilancioData(BaseModel):
-    tipo_bilancio: Optional[str] = None
-    periodo: Optional[str] = None
-    attivita: Optional[Dict[str, float]] = None
-    passivita: Optional[Dict[str, float]] = None
-    patrimonio_netto: Optional[float] = None
-    ricavi: Optional[float] = None
-    costi: Optional[float] = None
-    utile_perdita: Optional[float] = None
+    tipo_bilancio: OptStr
+    periodo: OptStr
+    attivita: OptFloatMap
+    passivita: OptFloatMap
+    patrimonio_netto: OptFloat
+    ricavi: OptFloat
+    costi: OptFloat
+    utile_perdita: OptFloat
 
 
 class MagazzinoData(BaseModel):
-    tipo_documento: Optional[str] = None
-    data: Optional[str] = None
-    articoli: Optional[List[Dict[str, Any]]] = None
-    totale_quantita: Optional[float] = None
-    totale_valore: Optional[float] = None
-    magazzino_codice: Optional[str] = None
+    tipo_documento: OptStr
+    data: OptStr
+    articoli: OptRecordList
+    totale_quantita: OptFloat
+    totale_valore: OptFloat
+    magazzino_codice: OptStr
 
 
 class CorrispettivoData(BaseModel):
-    numero_documento: Optional[str] = None
-    data: Optional[str] = None
-    importo_totale: Optional[float] = None
-    iva: Optional[float] = None
-    esercente: Optional[Dict[str, str]] = None
-    prodotti: Optional[List[Dict[str, Any]]] = None
+    numero_documento: OptStr
+    data: OptStr
+    importo_totale: OptFloat
+    iva: OptFloat
+    esercente: OptStrMap
+    prodotti: OptRecordList
 
 
 class AnalisiMercatoData(BaseModel):
-    titolo: Optional[str] = None
-    periodo: Optional[str] = None
-    settore: Optional[str] = None
-    dati_analitici: Optional[Dict[str, Any]] = None
-    grafici_descrizioni: Optional[List[str]] = None
-    conclusioni: Optional[str] = None
+    titolo: OptStr
+    periodo: OptStr
+    settore: OptStr
+    dati_analitici: OptAnyMap
+    grafici_descrizioni: OptStrList
+    conclusioni: OptStr
+
+
+# Modello dei dati estratti per ciascun tipo di documento
+_TYPED_DATA_MODELS = {
+    DocumentType.FATTURA: FatturaData,
+    DocumentType.BILANCIO: BilancioData,
+    DocumentType.MAGAZZINO: MagazzinoData,
+    DocumentType.CORRISPETTIVO: CorrispettivoData,
+    DocumentType.ANALISI_MERCATO: AnalisiMercatoData,
+}
 
 
-class ExtractedData(BaseModel):
+class ExtractedData(dict):
     """Dati estratti dal documento, la struttura dipende dal tipo di documento"""
-    __root__: Dict[str, Any] = {}
+    __slots__ = ()
+    
+    # Stessa interfaccia dei modelli Pydantic senza il costo di validazione
+    model_dump = dict.copy
 
 
 class ProcessingNote(BaseModel):
@@ -100,7 +131,7 @@ class ProcessingNote(BaseModel):
 
 class DocumentProcessingResult(BaseModel):
     """Risultato del processamento del documento"""
-    document_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    document_id: str = Field(default_factory=new_id)
     processing_timestamp: datetime = Field(default_factory=datetime.now)
     document_type: DocumentType = DocumentType.SCONOSCIUTO
     confidence_score: float = Field(..., ge=0.0, le=1.0)
@@ -112,15 +143,5 @@ class DocumentProcessingResult(BaseModel):
 
     def get_typed_extracted_data(self):
         """Restituisce i dati estratti tipizzati in base al tipo di documento"""
-        if self.document_type == DocumentType.FATTURA:
-            return FatturaData(**self.extracted_data)
-        elif self.document_type == DocumentType.BILANCIO:
-            return BilancioData(**self.extracted_data)
-        elif self.document_type == DocumentType.MAGAZZINO:
-            return MagazzinoData(**self.extracted_data)
-        elif self.document_type == DocumentType.CORRISPETTIVO:
-            return CorrispettivoData(**self.extracted_data)
-        elif self.document_type == DocumentType.ANALISI_MERCATO:
-            return AnalisiMercatoData(**self.extracted_data)
-        else:
-            return self.extracted_data
+        model = _TYPED_DATA_MODELS.get(self.document_type)
+        return model(**self.extracted_data) if model else self.extracted_data
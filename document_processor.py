@@ -1,19 +1,18 @@
 import os
 import time
 import json
-from typing import Dict, Any, Optional, Tuple
-import uuid
+import asyncio
+from concurrent.futures import Executor
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Dict, Any, Mapping, Optional, Tuple, Callable
 
 from app.config.settings import settings
 from app.utils.logging_utils import get_logger
 from app.utils.file_utils import (
     get_file_extension, 
-    is_allowed_image, 
-    is_allowed_pdf,
-    cleanup_temp_file
+    get_extension_category,
+    schedule_temp_file_cleanup
 )
-from app.services.image_processor import ImageProcessor
-from app.services.pdf_processor import PDFProcessor
 from app.services.llm_service import LLMService
 from app.models.document import (
     DocumentType, 
@@ -23,19 +22,81 @@ from app.models.document import (
     ProcessingRequest
 )
 
+if TYPE_CHECKING:
+    from app.services.image_processor import ImageProcessor
+    from app.services.pdf_processor import PDFProcessor
+
 logger = get_logger(__name__)
 
+# Mapping vuoto condiviso e immutabile per le letture con default, senza allocare un dict
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+# Processori usati dalle funzioni CPU-bound, creati alla prima chiamata in ciascun processo
+_image_processor: Optional["ImageProcessor"] = None
+_pdf_processor: Optional["PDFProcessor"] = None
+
+
+def _process_image_sync(image_path: str) -> Tuple[str, Dict[str, Any]]:
+    """Esegue OCR e analisi di un'immagine (pensata per girare in un pool di processi)"""
+    global _image_processor
+    if _image_processor is None:
+        # Import alla prima chiamata: PIL e pytesseract servono solo nei processi che fanno OCR
+        from app.services.image_processor import ImageProcessor
+        _image_processor = ImageProcessor()
+    return _image_processor.process_image(image_path)
+
+
+def _process_pdf_sync(pdf_path: str) -> Tuple[str, Dict[str, Any]]:
+    """Esegue estrazione testo e OCR di un PDF (pensata per girare in un pool di processi)"""
+    global _pdf_processor
+    if _pdf_processor is None:
+        # Import alla prima chiamata: pypdf e pdf2image servono solo nei processi che elaborano PDF
+        from app.services.pdf_processor import PDFProcessor
+        _pdf_processor = PDFProcessor()
+    return _pdf_processor.process_pdf(pdf_path)
+
 
 class DocumentProcessor:
     """Service principale per il processamento dei documenti"""
     
-    def __init__(self):
-        """Inizializza il servizio di processamento documenti"""
-        self.image_processor = ImageProcessor()
-        self.pdf_processor = PDFProcessor()
+    def __init__(self, executor: Optional[Executor] = None):
+        """
+        Inizializza il servizio di processamento documenti
+        
+        Args:
+            executor: Executor per il lavoro CPU-bound (OCR, PDF).
+                      Se None viene usato il thread pool di default dell'event loop
+        """
+        self.executor = executor
+        # Limite ai job in volo nell'executor: oltre, le richieste attendono il proprio turno
+        self.executor_slots: Optional[asyncio.Semaphore] = None
         self.llm_service = LLMService()
+        
+        # Processore per ciascuna categoria di file supportata
+        self._handlers = {
+            "image": self._process_image,
+            "pdf": self._process_pdf
+        }
         logger.info("Document Processor inizializzato")
     
+    async def _run_cpu_bound(self, func: Callable, *args):
+        """
+        Esegue una funzione CPU-bound fuori dall'event loop
+        
+        Args:
+            func: Funzione di modulo (serializzabile per il pool di processi)
+            *args: Argomenti della funzione
+            
+        Returns:
+            Risultato della funzione
+        """
+        loop = asyncio.get_running_loop()
+        if self.executor_slots is None:
+            return await loop.run_in_executor(self.executor, func, *args)
+        
+        async with self.executor_slots:
+            return await loop.run_in_executor(self.executor, func, *args)
+    
     async def process_document(
         self, 
         file_path: str, 
@@ -57,35 +118,38 @@ class DocumentProcessor:
         Returns:
             Risultato del processamento del documento
         """
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
+        
+        # Crea richiesta se non fornita
+        if not request:
+            request = ProcessingRequest()
+        
+        file_extension = get_file_extension(original_filename)
+        file_type = FileType._value2member_map_.get(file_extension)
         
         try:
-            logger.info(f"Inizio processamento documento: {original_filename}")
-            
-            # Crea richiesta se non fornita
-            if not request:
-                request = ProcessingRequest()
-            
-            # Determina il tipo di file
-            file_extension = get_file_extension(original_filename)
-            if is_allowed_image(original_filename):
-                file_type = FileType(file_extension.lower())
-                result = await self._process_image(file_path, request.document_type_hint)
-            elif is_allowed_pdf(original_filename):
-                file_type = FileType.PDF
-                result = await self._process_pdf(file_path, request.document_type_hint)
-            else:
-                raise ValueError(f"Tipo di file non supportato: {file_extension}")
+            logger.info("Inizio processamento documento: {}", original_filename)
+            
+            # Seleziona il processore in base alla categoria dell'estensione già calcolata
+            handler = self._handlers.get(get_extension_category(file_extension))
+            if handler is None:
+                logger.warning("Tipo di file non supportato: {}", original_filename)
+                return self._error_result(
+                    request, original_filename, file_type, file_size, md5_hash, start_ns,
+                    f"Tipo di file non supportato: {file_extension}"
+                )
+            
+            result = await handler(file_path, request.document_type_hint)
             
             # Calcola il tempo di processamento
-            processing_time_ms = int((time.time() - start_time) * 1000)
+            processing_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
             
             # Crea i metadati
             metadata = DocumentMetadata(
                 original_filename=original_filename,
                 file_type=file_type,
                 file_size=file_size,
-                pages_processed=result.get("metadata", {}).get("page_count", 1) if "metadata" in result else 1,
+                pages_processed=(result.get("metadata") or _EMPTY).get("page_count", 1),
                 processing_time_ms=processing_time_ms,
                 md5_hash=md5_hash
             )
@@ -93,7 +157,7 @@ class DocumentProcessor:
             # Crea il risultato
             document_result = DocumentProcessingResult(
                 document_id=request.document_id,
-                document_type=DocumentType(result.get("document_type", "sconosciuto")),
+                document_type=DocumentType.from_value(result.get("document_type")),
                 confidence_score=result.get("confidence_score", 0.0),
                 metadata=metadata,
                 extracted_data=result.get("extracted_data", {}),
@@ -102,44 +166,74 @@ class DocumentProcessor:
                 llm_ready=True
             )
             
-            logger.info(f"Processamento documento completato: {original_filename}, "
-                        f"tipo: {document_result.document_type}, "
-                        f"confidence: {document_result.confidence_score:.2f}, "
-                        f"tempo: {processing_time_ms}ms")
+            logger.info(
+                "Processamento documento completato: {}, tipo: {}, confidence: {:.2f}, tempo: {}ms",
+                original_filename,
+                document_result.document_type,
+                document_result.confidence_score,
+                processing_time_ms
+            )
             
             return document_result
         except Exception as e:
-            logger.error(f"Errore durante il processamento del documento {original_filename}: {e}")
-            
-            # Calcola il tempo di processamento anche in caso di errore
-            processing_time_ms = int((time.time() - start_time) * 1000)
-            
-            # Crea metadati minimi
-            metadata = DocumentMetadata(
-                original_filename=original_filename,
-                file_type=FileType(get_file_extension(original_filename).lower()),
-                file_size=file_size,
-                pages_processed=0,
-                processing_time_ms=processing_time_ms,
-                md5_hash=md5_hash
-            )
+            logger.error("Errore durante il processamento del documento {}: {}", original_filename, e)
             
-            # Crea risultato di errore
-            document_result = DocumentProcessingResult(
-                document_id=request.document_id if request else str(uuid.uuid4()),
-                document_type=DocumentType.SCONOSCIUTO,
-                confidence_score=0.0,
-                metadata=metadata,
-                extracted_data={},
-                raw_text="",
-                processing_notes=[f"Errore durante il processamento: {str(e)}"],
-                llm_ready=False
+            return self._error_result(
+                request, original_filename, file_type, file_size, md5_hash, start_ns,
+                f"Errore durante il processamento: {str(e)}"
             )
-            
-            return document_result
         finally:
-            # Pulisci il file temporaneo
-            cleanup_temp_file(file_path)
+            # Accoda il file temporaneo per la pulizia in background
+            schedule_temp_file_cleanup(file_path)
+    
+    def _error_result(
+        self,
+        request: ProcessingRequest,
+        original_filename: str,
+        file_type: Optional[FileType],
+        file_size: int,
+        md5_hash: str,
+        start_ns: int,
+        note: str
+    ) -> DocumentProcessingResult:
+        """
+        Crea il risultato per un documento non processato
+        
+        Args:
+            request: Richiesta di processamento
+            original_filename: Nome originale del file
+            file_type: Tipo di file (None se non supportato)
+            file_size: Dimensione del file in byte
+            md5_hash: Hash MD5 del file
+            start_ns: Istante di inizio del processamento (perf_counter_ns)
+            note: Nota da riportare nel risultato
+            
+        Returns:
+            Risultato di errore, non pronto per l'LLM
+        """
+        # Calcola il tempo di processamento anche in caso di errore
+        processing_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+        
+        # Crea metadati minimi
+        metadata = DocumentMetadata(
+            original_filename=original_filename,
+            file_type=file_type,
+            file_size=file_size,
+            pages_processed=0,
+            processing_time_ms=processing_time_ms,
+            md5_hash=md5_hash
+        )
+        
+        return DocumentProcessingResult(
+            document_id=request.document_id,
+            document_type=DocumentType.SCONOSCIUTO,
+            confidence_score=0.0,
+            metadata=metadata,
+            extracted_data={},
+            raw_text="",
+            processing_notes=[note],
+            llm_ready=False
+        )
     
     async def _process_image(
         self, 
@@ -157,43 +251,49 @@ class DocumentProcessor:
             Risultati del processamento
         """
         try:
-            logger.info(f"Processamento immagine: {image_path}")
+            logger.info("Processamento immagine: {}", image_path)
             
             # Estrai testo e analisi dall'immagine
-            text, image_analysis = self.image_processor.process_image(image_path)
+            text, image_analysis = await self._run_cpu_bound(_process_image_sync, image_path)
             
-            # Se il testo è troppo corto, usa direttamente Mistral Vision
-            if len(text.strip()) < 200:
-                logger.info(f"Testo OCR insufficiente ({len(text)} caratteri), uso diretto di Mistral Vision")
+            # Dati OCR letti una sola volta per la scelta del percorso e per le note
+            ocr_data = image_analysis.get("ocr_data")
+            low_confidence = (ocr_data or _EMPTY).get("confidence", 0) < 70
+            
+            # Percorso comune: testo OCR sufficiente, analisi diretta del testo con l'LLM
+            if len(text.strip()) >= 200:
+                analysis = await self.llm_service.analyze_document_text(text, document_type_hint)
+                analysis["raw_text"] = text
+            else:
+                # Testo troppo corto: usa direttamente Mistral Vision
+                logger.info("Testo OCR insufficiente ({} caratteri), uso diretto di Mistral Vision", len(text))
                 analysis = await self.llm_service.analyze_document_image(image_path, document_type_hint)
                 
                 # Usa il testo estratto da Mistral Vision
-                if "raw_text" in analysis and analysis["raw_text"]:
-                    text = analysis["raw_text"]
-            else:
-                # Analizza il testo con l'LLM
-                analysis = await self.llm_service.analyze_document_text(text, document_type_hint)
-                analysis["raw_text"] = text
+                vision_text = analysis.get("raw_text")
+                if vision_text:
+                    text = vision_text
             
             # Aggiungi informazioni dall'analisi dell'immagine
-            analysis["image_info"] = image_analysis.get("image_info", {})
-            analysis["ocr_info"] = image_analysis.get("ocr_data", {})
+            analysis["image_info"] = image_analysis.get("image_info") or {}
+            analysis["ocr_info"] = ocr_data or {}
             
             # Aggiungi note sul processamento
             processing_notes = []
             
-            if analysis.get("error"):
-                processing_notes.append(f"Errore nell'analisi: {analysis['error']}")
+            error = analysis.get("error")
+            if error:
+                processing_notes.append(f"Errore nell'analisi: {error}")
             
-            if image_analysis.get("ocr_data", {}).get("confidence", 0) < 70:
+            if low_confidence:
                 processing_notes.append("Bassa confidenza OCR, i risultati potrebbero non essere accurati")
             
             analysis["processing_notes"] = processing_notes
             
-            logger.info(f"Processamento immagine completato: {image_path}")
+            logger.info("Processamento immagine completato: {}", image_path)
             return analysis
         except Exception as e:
-            logger.error(f"Errore durante il processamento dell'immagine {image_path}: {e}")
+            logger.error("Errore durante il processamento dell'immagine {}: {}", image_path, e)
             raise
     
     async def _process_pdf(
@@ -212,16 +312,16 @@ class DocumentProcessor:
             Risultati del processamento
         """
         try:
-            logger.info(f"Processamento PDF: {pdf_path}")
+            logger.info("Processamento PDF: {}", pdf_path)
             
             # Estrai testo e metadati dal PDF
-            text, pdf_info = self.pdf_processor.process_pdf(pdf_path)
+            text, pdf_info = await self._run_cpu_bound(_process_pdf_sync, pdf_path)
             
             # Analizza il testo con l'LLM
             analysis = await self.llm_service.analyze_document_text(text, document_type_hint)
             
             # Aggiungi informazioni dal PDF
-            analysis["metadata"] = pdf_info.get("metadata", {})
+            analysis["metadata"] = pdf_info.get("metadata") or {}
             analysis["raw_text"] = text
             
             # Aggiungi note sul processamento
@@ -244,8 +344,8 @@ class DocumentProcessor:
             
             analysis["processing_notes"] = processing_notes
             
-            logger.info(f"Processamento PDF completato: {pdf_path}")
+            logger.info("Processamento PDF completato: {}", pdf_path)
             return analysis
         except Exception as e:
-            logger.error(f"Errore durante il processamento del PDF {pdf_path}: {e}")
+            logger.error("Errore durante il processamento del PDF {}: {}", pdf_path, e)
             raise
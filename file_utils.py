@@ -1,50 +1,83 @@
 import os
-import uuid
+import asyncio
 import hashlib
-import aiofiles
 import shutil
-from typing import Tuple, Optional, List
-from fastapi import UploadFile
+import psutil
+from typing import Tuple, Optional, List, BinaryIO
+from fastapi import UploadFile, HTTPException
 from pathlib import Path
 import tempfile
 
-from app.config.settings import settings
+from app.config.settings import (
+    settings,
+    IMAGE_EXTENSIONS,
+    PDF_EXTENSIONS,
+    ALLOWED_EXTENSIONS,
+    MAX_FILE_SIZE_BYTES
+)
 from app.utils.logging_utils import get_logger
+from app.utils.id_utils import new_hex_id
 
 logger = get_logger(__name__)
 
+# Impostazioni usate ad ogni upload, lette una sola volta dal BaseSettings
+TEMP_FOLDER = settings.TEMP_FOLDER
+UPLOAD_CHUNK_SIZE = settings.UPLOAD_CHUNK_SIZE
+
+# Coda condivisa per l'eliminazione dei file temporanei fuori dal ciclo della richiesta
+CLEANUP_BATCH_SIZE = 32
+# Attesa massima, all'arresto, per lo smaltimento dei file ancora in coda
+CLEANUP_SHUTDOWN_TIMEOUT_SECONDS = 10
+_cleanup_queue: Optional[asyncio.Queue] = None
+_cleanup_task: Optional[asyncio.Task] = None
+
+# Sottocartella temporanea del processo worker corrente, creata una volta all'avvio
+WORKER_DIR_PREFIX = "worker-"
+_worker_temp_dir: Optional[Path] = None
+
+
+# Categoria di file per ciascuna estensione supportata
+_EXT_TO_CATEGORY = {
+    **{ext: "image" for ext in IMAGE_EXTENSIONS},
+    **{ext: "pdf" for ext in PDF_EXTENSIONS}
+}
+
 
 def get_file_extension(filename: str) -> str:
     """Ottiene l'estensione del file"""
-    return Path(filename).suffix.lstrip(".").lower()
+    dot = filename.rfind(".")
+    return filename[dot + 1:].lower() if dot >= 0 else ""
+
+
+def get_extension_category(extension: str) -> Optional[str]:
+    """Restituisce la categoria di un'estensione già normalizzata, None se non supportata"""
+    return _EXT_TO_CATEGORY.get(extension)
+
+
+def get_file_category(filename: str) -> Optional[str]:
+    """Restituisce la categoria del file ("image" o "pdf"), None se non supportato"""
+    return _EXT_TO_CATEGORY.get(get_file_extension(filename))
 
 
 def is_allowed_image(filename: str) -> bool:
     """Verifica se il file è un'immagine supportata"""
-    ext = get_file_extension(filename)
-    return ext in settings.ALLOWED_IMAGE_EXTENSIONS
+    return get_file_extension(filename) in IMAGE_EXTENSIONS
 
 
 def is_allowed_pdf(filename: str) -> bool:
     """Verifica se il file è un PDF"""
-    ext = get_file_extension(filename)
-    return ext in settings.ALLOWED_PDF_EXTENSIONS
+    return get_file_extension(filename) in PDF_EXTENSIONS
 
 
 def is_allowed_file(filename: str) -> bool:
     """Verifica se il file è supportato"""
-    return is_allowed_image(filename) or is_allowed_pdf(filename)
+    return get_file_extension(filename) in ALLOWED_EXTENSIONS
 
 
 def get_file_type(filename: str) -> str:
     """Ottiene il tipo di file"""
     ext = get_file_extension(filename)
-    if ext in settings.ALLOWED_IMAGE_EXTENSIONS:
-        return ext
-    elif ext in settings.ALLOWED_PDF_EXTENSIONS:
-        return ext
-    else:
-        return "unknown"
+    return ext if ext in ALLOWED_EXTENSIONS else "unknown"
 
 
 def get_file_size_mb(file_size_bytes: int) -> float:
@@ -54,8 +87,137 @@ def get_file_size_mb(file_size_bytes: int) -> float:
 
 def is_file_size_allowed(file_size_bytes: int) -> bool:
     """Verifica se la dimensione del file rientra nei limiti"""
-    file_size_mb = get_file_size_mb(file_size_bytes)
-    return file_size_mb <= settings.MAX_FILE_SIZE_MB
+    return file_size_bytes <= MAX_FILE_SIZE_BYTES
+
+
+def init_worker_temp_dir() -> Path:
+    """
+    Crea la sottocartella temporanea del processo worker corrente
+    
+    Returns:
+        Percorso della cartella TEMP_FOLDER/worker-{pid}
+    """
+    global _worker_temp_dir
+    
+    _worker_temp_dir = Path(TEMP_FOLDER) / f"{WORKER_DIR_PREFIX}{os.getpid()}"
+    _worker_temp_dir.mkdir(parents=True, exist_ok=True)
+    return _worker_temp_dir
+
+
+def get_worker_temp_dir() -> Path:
+    """Restituisce la cartella temporanea del worker, creandola se necessario"""
+    if _worker_temp_dir is None:
+        return init_worker_temp_dir()
+    return _worker_temp_dir
+
+
+def cleanup_stale_worker_dirs() -> None:
+    """Elimina le cartelle temporanee lasciate da worker non più in esecuzione"""
+    temp_root = Path(TEMP_FOLDER)
+    if not temp_root.is_dir():
+        return
+    
+    current_pid = os.getpid()
+    for entry in temp_root.iterdir():
+        pid = entry.name[len(WORKER_DIR_PREFIX):]
+        if not entry.name.startswith(WORKER_DIR_PREFIX) or not pid.isdigit():
+            continue
+        
+        # Un PID riusato dal worker corrente indica comunque una cartella residua
+        if int(pid) == current_pid or not psutil.pid_exists(int(pid)):
+            shutil.rmtree(entry, ignore_errors=True)
+            logger.info("Cartella temporanea di un worker terminato eliminata: {}", entry)
+
+
+def _new_md5():
+    """Nuovo hash MD5: serve solo come identificativo del contenuto, non per sicurezza"""
+    return hashlib.md5(usedforsecurity=False)
+
+
+class FileTooLargeError(HTTPException):
+    """Errore per upload oltre la dimensione massima consentita (HTTP 413)"""
+    
+    def __init__(self):
+        super().__init__(
+            status_code=413,
+            detail=f"Il file supera la dimensione massima consentita di {settings.MAX_FILE_SIZE_MB}MB"
+        )
+
+
+def _sendfile_upload(source: BinaryIO, file_path: Path, file_size: int) -> str:
+    """
+    Copia con os.sendfile un upload già riversato su disco e ne calcola l'hash MD5
+    
+    Args:
+        source: File sorgente su disco
+        file_path: Percorso di destinazione
+        file_size: Dimensione del file sorgente in byte
+        
+    Returns:
+        Hash MD5 del file
+    """
+    source_fd = source.fileno()
+    
+    # Copia nel kernel, senza passare i dati per lo spazio utente
+    with open(file_path, 'wb') as out_file:
+        offset = 0
+        while offset < file_size:
+            sent = os.sendfile(out_file.fileno(), source_fd, offset, file_size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    
+    # file_digest legge con readinto in un buffer riusato, senza copie in Python
+    with open(source_fd, 'rb', buffering=0, closefd=False) as raw_source:
+        raw_source.seek(0)
+        return hashlib.file_digest(raw_source, _new_md5).hexdigest()
+
+
+def _write_upload(source: BinaryIO, file_path: Path, chunk_size: int) -> Tuple[str, int]:
+    """
+    Copia in modo sincrono il contenuto dell'upload su disco calcolando l'hash MD5
+    
+    Args:
+        source: File sorgente (SpooledTemporaryFile dell'upload)
+        file_path: Percorso di destinazione
+        chunk_size: Dimensione dei chunk di lettura/scrittura
+        
+    Returns:
+        Tuple con hash MD5 e dimensione in byte
+    
+    Raises:
+        FileTooLargeError: Se il file supera la dimensione massima consentita
+    """
+    # Lo SpooledTemporaryFile passa su disco oltre la soglia di memoria:
+    # in quel caso il file ha un descrittore reale e si può usare sendfile
+    if getattr(source, "_rolled", False) and hasattr(os, "sendfile"):
+        source.flush()
+        source.seek(0, os.SEEK_END)
+        file_size = source.tell()
+        
+        if file_size > MAX_FILE_SIZE_BYTES:
+            raise FileTooLargeError()
+        
+        if file_size > 0:
+            return _sendfile_upload(source, file_path, file_size), file_size
+    
+    # Hash calcolato nello stesso passaggio della copia
+    md5_hash = _new_md5()
+    file_size = 0
+    
+    source.seek(0)
+    with open(file_path, 'wb', buffering=0) as out_file:
+        while chunk := source.read(chunk_size):
+            file_size += len(chunk)
+            
+            # Interrompe la copia anche se il Content-Length era assente o falso
+            if file_size > MAX_FILE_SIZE_BYTES:
+                raise FileTooLargeError()
+            
+            md5_hash.update(chunk)
+            out_file.write(chunk)
+    
+    return md5_hash.hexdigest(), file_size
 
 
 async def save_upload_file(upload_file: UploadFile) -> Tuple[str, str, int]:
@@ -68,30 +230,24 @@ async def save_upload_file(upload_file: UploadFile) -> Tuple[str, str, int]:
     Returns:
         Tuple con percorso file, hash MD5 e dimensione in byte
     """
-    temp_dir = Path(settings.TEMP_FOLDER)
-    temp_dir.mkdir(parents=True, exist_ok=True)
+    # Cartella già creata all'avvio del worker: nessun mkdir per upload
+    temp_dir = get_worker_temp_dir()
     
     # Genera un nome file unico
     file_extension = get_file_extension(upload_file.filename)
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
+    unique_filename = f"{new_hex_id()}.{file_extension}"
     file_path = temp_dir / unique_filename
     
-    # Calcola l'hash MD5 mentre salva il file
-    md5_hash = hashlib.md5()
-    file_size = 0
-    
     try:
-        async with aiofiles.open(file_path, 'wb') as out_file:
-            # Leggi il file a chunk
-            while content := await upload_file.read(1024 * 1024):  # 1MB chunks
-                file_size += len(content)
-                md5_hash.update(content)
-                await out_file.write(content)
+        # I/O su file sincrono in un thread: più rapido di aiofiles e non blocca l'event loop
+        md5_hash, file_size = await asyncio.to_thread(
+            _write_upload, upload_file.file, file_path, UPLOAD_CHUNK_SIZE
+        )
                 
-        logger.info(f"File salvato: {file_path}, dimensione: {file_size} bytes")
-        return str(file_path), md5_hash.hexdigest(), file_size
+        logger.info("File salvato: {}, dimensione: {} bytes", file_path, file_size)
+        return str(file_path), md5_hash, file_size
     except Exception as e:
-        logger.error(f"Errore durante il salvataggio del file: {e}")
+        logger.error("Errore durante il salvataggio del file: {}", e)
         # Cancella il file se esiste
         if file_path.exists():
             file_path.unlink()
@@ -103,9 +259,9 @@ def cleanup_temp_file(file_path: str) -> None:
     try:
         if os.path.exists(file_path):
             os.remove(file_path)
-            logger.info(f"File temporaneo eliminato: {file_path}")
+            logger.info("File temporaneo eliminato: {}", file_path)
     except Exception as e:
-        logger.error(f"Errore durante l'eliminazione del file temporaneo {file_path}: {e}")
+        logger.error("Errore durante l'eliminazione del file temporaneo {}: {}", file_path, e)
 
 
 def cleanup_temp_files(file_paths: List[str]) -> None:
@@ -114,13 +270,86 @@ def cleanup_temp_files(file_paths: List[str]) -> None:
         cleanup_temp_file(file_path)
 
 
-def cleanup_temp_directory() -> None:
-    """Pulisce la directory temporanea"""
+async def _cleanup_worker() -> None:
+    """Elimina in background i file temporanei accodati, a batch"""
+    while True:
+        batch = [await _cleanup_queue.get()]
+        
+        # Raccoglie gli altri file già in coda per eliminarli in un unico passaggio
+        while len(batch) < CLEANUP_BATCH_SIZE and not _cleanup_queue.empty():
+            batch.append(_cleanup_queue.get_nowait())
+        
+        try:
+            await asyncio.to_thread(cleanup_temp_files, batch)
+        finally:
+            # Segna il batch come smaltito: stop_cleanup_worker attende la coda vuota
+            for _ in batch:
+                _cleanup_queue.task_done()
+
+
+def start_cleanup_worker() -> None:
+    """Avvia il worker di pulizia dei file temporanei nell'event loop corrente"""
+    global _cleanup_queue, _cleanup_task
+    
+    _cleanup_queue = asyncio.Queue()
+    _cleanup_task = asyncio.create_task(_cleanup_worker())
+    logger.info("Worker di pulizia dei file temporanei avviato")
+
+
+async def stop_cleanup_worker() -> None:
+    """Ferma il worker di pulizia ed elimina i file ancora in coda"""
+    global _cleanup_queue, _cleanup_task
+    
+    if _cleanup_task is None:
+        return
+    
+    # Lascia finire al worker i file accodati, compreso il batch in corso,
+    # invece di interromperlo a metà con l'annullamento
+    try:
+        await asyncio.wait_for(_cleanup_queue.join(), CLEANUP_SHUTDOWN_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning("Pulizia dei file temporanei in coda non completata entro {}s", CLEANUP_SHUTDOWN_TIMEOUT_SECONDS)
+    
+    _cleanup_task.cancel()
+    try:
+        await _cleanup_task
+    except asyncio.CancelledError:
+        pass
+    
+    pending = []
+    while not _cleanup_queue.empty():
+        pending.append(_cleanup_queue.get_nowait())
+    cleanup_temp_files(pending)
+    
+    _cleanup_queue = None
+    _cleanup_task = None
+    logger.info("Worker di pulizia dei file temporanei arrestato")
+
+
+def schedule_temp_file_cleanup(file_path: str) -> None:
+    """Accoda un file temporaneo per l'eliminazione in background"""
+    if _cleanup_queue is None:
+        # Worker non avviato (es. uso fuori dall'applicazione): elimina subito
+        cleanup_temp_file(file_path)
+        return
+    
+    _cleanup_queue.put_nowait(file_path)
+
+
+def cleanup_temp_directory(recreate: bool = True) -> None:
+    """
+    Pulisce la directory temporanea del worker corrente
+    
+    Args:
+        recreate: Se ricreare la cartella vuota dopo la pulizia
+    """
     try:
-        temp_dir = Path(settings.TEMP_FOLDER)
+        # Solo la cartella di questo worker: gli altri processi hanno i propri file in uso
+        temp_dir = get_worker_temp_dir()
         if temp_dir.exists():
             shutil.rmtree(temp_dir)
-            logger.info(f"Directory temporanea eliminata: {temp_dir}")
+            logger.info("Directory temporanea eliminata: {}", temp_dir)
+        if recreate:
             temp_dir.mkdir(parents=True, exist_ok=True)
     except Exception as e:
-        logger.error(f"Errore durante la pulizia della directory temporanea: {e}")
+        logger.error("Errore durante la pulizia della directory temporanea: {}", e)
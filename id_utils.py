@@ -0,0 +1,59 @@
+import os
+import threading
+
+# Byte casuali letti con una sola chiamata a os.urandom e consumati 16 alla volta
+_RANDOM_BUFFER_SIZE = 4096
+_ID_BYTES = 16
+
+_lock = threading.Lock()
+_buffer = b""
+_offset = 0
+
+
+def _next_random_bytes() -> bytes:
+    """Restituisce 16 byte casuali dal buffer, ricaricandolo quando è esaurito"""
+    global _buffer, _offset
+
+    with _lock:
+        if _offset + _ID_BYTES > len(_buffer):
+            _buffer = os.urandom(_RANDOM_BUFFER_SIZE)
+            _offset = 0
+        start = _offset
+        _offset += _ID_BYTES
+        return _buffer[start:_offset]
+
+
+def new_hex_id() -> str:
+    """
+    Genera un UUID4 in formato esadecimale compatto (32 caratteri, senza trattini)
+
+    Returns:
+        Identificativo equivalente a uuid.uuid4().hex
+    """
+    raw = bytearray(_next_random_bytes())
+    raw[6] = (raw[6] & 0x0F) | 0x40  # versione 4
+    raw[8] = (raw[8] & 0x3F) | 0x80  # variante RFC 4122
+    return raw.hex()
+
+
+def new_id() -> str:
+    """
+    Genera un UUID4 in formato standard con trattini
+
+    Returns:
+        Identificativo equivalente a str(uuid.uuid4())
+    """
+    h = new_hex_id()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _reset_after_fork() -> None:
+    """Scarta il buffer nei processi figli: altrimenti genererebbero gli stessi ID del padre"""
+    global _lock, _buffer, _offset
+
+    _lock = threading.Lock()
+    _buffer = b""
+    _offset = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
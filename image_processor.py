@@ -1,11 +1,10 @@
 from PIL import Image, ImageEnhance, ImageFilter
 import os
 from typing import List, Dict, Any, Optional, Tuple
-import uuid
-from pathlib import Path
 
-from app.config.settings import settings
 from app.utils.logging_utils import get_logger
+from app.utils.id_utils import new_hex_id
+from app.utils.file_utils import get_worker_temp_dir
 from app.services.ocr_service import OCRService
 
 logger = get_logger(__name__)
@@ -30,7 +29,7 @@ class ImageProcessor:
             Percorso dell'immagine preprocessata
         """
         try:
-            logger.info(f"Preprocessamento immagine: {image_path}")
+            logger.info("Preprocessamento immagine: {}", image_path)
             
             # Carica l'immagine
             image = Image.open(image_path)
@@ -51,16 +50,15 @@ class ImageProcessor:
             image = image.point(lambda p: 255 if p > threshold_value else 0)
             
             # Salva l'immagine preprocessata
-            temp_dir = Path(settings.TEMP_FOLDER)
-            temp_dir.mkdir(parents=True, exist_ok=True)
+            temp_dir = get_worker_temp_dir()
             
-            preprocessed_path = temp_dir / f"preprocessed_{uuid.uuid4()}.png"
+            preprocessed_path = temp_dir / f"preprocessed_{new_hex_id()}.png"
             image.save(preprocessed_path)
             
-            logger.info(f"Immagine preprocessata salvata in: {preprocessed_path}")
+            logger.info("Immagine preprocessata salvata in: {}", preprocessed_path)
             return str(preprocessed_path)
         except Exception as e:
-            logger.error(f"Errore durante il preprocessamento dell'immagine {image_path}: {e}")
+            logger.error("Errore durante il preprocessamento dell'immagine {}: {}", image_path, e)
             return image_path  # Restituisci l'immagine originale in caso di errore
     
     def extract_text(self, image_path: str, preprocess: bool = True) -> str:
@@ -87,7 +85,7 @@ class ImageProcessor:
             
             return text
         except Exception as e:
-            logger.error(f"Errore durante l'estrazione del testo dall'immagine {image_path}: {e}")
+            logger.error("Errore durante l'estrazione del testo dall'immagine {}: {}", image_path, e)
             return ""
     
     def analyze_image(self, image_path: str) -> Dict[str, Any]:
@@ -101,7 +99,7 @@ class ImageProcessor:
             Dizionario con informazioni sull'immagine
         """
         try:
-            logger.info(f"Analisi immagine: {image_path}")
+            logger.info("Analisi immagine: {}", image_path)
             
             # Carica l'immagine
             image = Image.open(image_path)
@@ -133,10 +131,10 @@ class ImageProcessor:
                 "ocr_data": ocr_data
             }
             
-            logger.info(f"Analisi immagine completata per {image_path}")
+            logger.info("Analisi immagine completata per {}", image_path)
             return analysis
         except Exception as e:
-            logger.error(f"Errore durante l'analisi dell'immagine {image_path}: {e}")
+            logger.error("Errore durante l'analisi dell'immagine {}: {}", image_path, e)
             return {
                 "image_info": {},
                 "ocr_data": {
@@ -159,7 +157,7 @@ class ImageProcessor:
             Tupla con testo estratto e informazioni sull'immagine
         """
         try:
-            logger.info(f"Processamento immagine: {image_path}")
+            logger.info("Processamento immagine: {}", image_path)
             
             # Analizza l'immagine
             analysis = self.analyze_image(image_path)
@@ -167,10 +165,10 @@ class ImageProcessor:
             # Estrai il testo
             text = analysis["ocr_data"]["text"]
             
-            logger.info(f"Processamento immagine completato per {image_path}")
+            logger.info("Processamento immagine completato per {}", image_path)
             return text, analysis
         except Exception as e:
-            logger.error(f"Errore durante il processamento dell'immagine {image_path}: {e}")
+            logger.error("Errore durante il processamento dell'immagine {}: {}", image_path, e)
             return "", {
                 "image_info": {},
                 "ocr_data": {
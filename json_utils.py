@@ -0,0 +1,42 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+# datetime, UUID, Enum e dataclass sono gestiti nativamente da orjson
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z
+
+
+def orjson_default(obj: Any) -> Any:
+    """
+    Converte i tipi non supportati nativamente da orjson
+
+    Args:
+        obj: Oggetto da serializzare
+
+    Returns:
+        Valore serializzabile da orjson
+
+    Raises:
+        TypeError: Se il tipo non è supportato
+    """
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    raise TypeError(f"Tipo non serializzabile in JSON: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Serializza in JSON con orjson e le opzioni dell'applicazione"""
+    return orjson.dumps(content, default=orjson_default, option=ORJSON_OPTIONS)
+
+
+class AppJSONResponse(ORJSONResponse):
+    """Risposta JSON serializzata con orjson e le opzioni dell'applicazione"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
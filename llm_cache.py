@@ -0,0 +1,82 @@
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class LLMCache:
+    """Cache in memoria delle risposte LLM, con scadenza (TTL) ed eliminazione LRU"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        """
+        Inizializza la cache
+
+        Args:
+            max_entries: Numero massimo di risposte conservate (0 disabilita la cache)
+            ttl_seconds: Durata di validità di una risposta in secondi
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Chiave -> (scadenza su time.monotonic, risposta), dalla meno alla più recente
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(body: bytes) -> str:
+        """
+        Calcola la chiave di cache di una richiesta
+
+        Args:
+            body: Corpo JSON della richiesta chat/completions (modello, messaggi, parametri),
+                  serializzato sempre con lo stesso ordine delle chiavi
+
+        Returns:
+            Hash SHA-256 esadecimale del corpo
+        """
+        return hashlib.sha256(body).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce la risposta in cache, se presente e non scaduta
+
+        Args:
+            key: Chiave calcolata con make_key
+
+        Returns:
+            Risposta LLM, None se assente o scaduta
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """
+        Salva una risposta, eliminando le meno recenti oltre il limite
+
+        Args:
+            key: Chiave calcolata con make_key
+            value: Risposta LLM da conservare
+        """
+        if self.max_entries <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Svuota la cache"""
+        self._entries.clear()
@@ -1,15 +1,175 @@
-import json
+import re
+import asyncio
 import httpx
+import orjson
 import base64
-from typing import Dict, Any, List, Optional
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from typing import Dict, Any, Optional
 
 from app.config.settings import settings
 from app.utils.logging_utils import get_logger
 from app.models.document import DocumentType
+from app.services.llm_cache import LLMCache
 
 logger = get_logger(__name__)
 
+# Parti statiche dei prompt, inviate come messaggio di sistema in testa alla richiesta:
+# restano identiche tra le chiamate e il provider può riusarne il prefisso in cache
+_DOCUMENT_TYPES_PROMPT = """Identifica il tipo di documento tra: fattura, bilancio, magazzino, corrispettivo, analisi_mercato.
+
+Estrai tutti i dettagli rilevanti in base al tipo di documento."""
+
+_DOCUMENT_FIELDS_PROMPT = """Se il documento è una fattura, includi: numero_fattura, data_fattura, importo_totale, iva, mittente, destinatario, righe_fattura, valuta.
+Se è un bilancio, includi: tipo_bilancio, periodo, attivita, passivita, patrimonio_netto, ricavi, costi, utile_perdita.
+Se è un documento di magazzino, includi: tipo_documento, data, articoli, totale_quantita, totale_valore, magazzino_codice.
+Se è un corrispettivo, includi: numero_documento, data, importo_totale, iva, esercente, prodotti.
+Se è un'analisi di mercato, includi: titolo, periodo, settore, dati_analitici, grafici_descrizioni, conclusioni.
+
+Assicurati che il JSON sia ben formato e valido."""
+
+_TEXT_SYSTEM_PROMPT = "\n\n".join([
+    "Analizza il documento di business fornito dall'utente e crea un riassunto strutturato in formato JSON.",
+    _DOCUMENT_TYPES_PROMPT,
+    """Restituisci la risposta in formato JSON con la seguente struttura:
+{
+    "document_type": "fattura|bilancio|magazzino|corrispettivo|analisi_mercato",
+    "confidence_score": 0.95, // Livello di confidenza nell'identificazione del tipo
+    "extracted_data": {
+        // Campi specifici in base al tipo di documento
+    },
+    "summary": "Breve riassunto del documento"
+}""",
+    _DOCUMENT_FIELDS_PROMPT
+])
+
+_IMAGE_SYSTEM_PROMPT = "\n\n".join([
+    "Analizza l'immagine del documento di business fornita dall'utente e crea un riassunto strutturato in formato JSON.",
+    _DOCUMENT_TYPES_PROMPT,
+    """Restituisci la risposta in formato JSON con la seguente struttura:
+{
+    "document_type": "fattura|bilancio|magazzino|corrispettivo|analisi_mercato",
+    "confidence_score": 0.95, // Livello di confidenza nell'identificazione del tipo
+    "extracted_data": {
+        // Campi specifici in base al tipo di documento
+    },
+    "raw_text": "Testo estratto dall'immagine",
+    "summary": "Breve riassunto del documento"
+}""",
+    _DOCUMENT_FIELDS_PROMPT
+])
+
+# Parti dinamiche dei prompt precalcolate per ogni suggerimento sul tipo (None = nessun suggerimento):
+# per ogni richiesta resta solo da accodare il testo del documento
+_IMAGE_PROMPT = "Analizza questa immagine di un documento di business."
+_TEXT_PROMPT_HEADS: Dict[Optional[DocumentType], str] = {None: "Documento:\n\n"}
+_IMAGE_PROMPTS: Dict[Optional[DocumentType], str] = {None: _IMAGE_PROMPT}
+for _type in DocumentType:
+    _hint = f"Suggerimento: Questo documento potrebbe essere di tipo {_type.value}."
+    _TEXT_PROMPT_HEADS[_type] = f"{_hint}\n\nDocumento:\n\n"
+    _IMAGE_PROMPTS[_type] = f"{_IMAGE_PROMPT}\n\n{_hint}"
+del _type, _hint
+
+# Spazi orizzontali consecutivi, spazi ai bordi delle righe e righe vuote ripetute nel testo OCR
+_HSPACE_RE = re.compile(r"[^\S\n]+")
+_LINE_EDGE_RE = re.compile(r" ?\n ?")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+# Prefisso del data URL delle immagini e blocco di lettura per la codifica base64:
+# un multiplo di 3 byte fa sì che i blocchi codificati si concatenino senza padding intermedio
+_IMAGE_DATA_URL_PREFIX = b"data:image/jpeg;base64,"
+_BASE64_READ_CHUNK = 57 * 1024
+
+# Segnaposto JSON sostituito con il data URL dell'immagine nel corpo già serializzato
+_IMAGE_URL_PLACEHOLDER = "__image_data_url__"
+_IMAGE_URL_PLACEHOLDER_JSON = orjson.dumps(_IMAGE_URL_PLACEHOLDER)
+
+# Tentativi per le chiamate all'API LLM e attesa tra i tentativi (backoff esponenziale, in secondi)
+_LLM_MAX_ATTEMPTS = 3
+_LLM_RETRY_MIN_WAIT = 2
+_LLM_RETRY_MAX_WAIT = 10
+
+# Limiti del pool di connessioni verso OpenRouter, condiviso da tutte le chiamate del worker
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+
+# Campi costanti del risultato restituito quando l'analisi LLM non va a buon fine
+_FALLBACK_ANALYSIS = {
+    "document_type": DocumentType.SCONOSCIUTO.value,
+    "confidence_score": 0.0
+}
+
+
+def _fallback_analysis(summary: str, error: str, **fields: Any) -> Dict[str, Any]:
+    """
+    Costruisce il risultato di un'analisi non riuscita
+    
+    Args:
+        summary: Riassunto da mostrare al posto di quello dell'LLM
+        error: Descrizione dell'errore
+        **fields: Campi aggiuntivi (es. raw_text per l'analisi di immagini)
+        
+    Returns:
+        Risultato con tipo sconosciuto e confidenza nulla
+    """
+    # extracted_data è creato ad ogni chiamata: il chiamante può modificarlo
+    return {**_FALLBACK_ANALYSIS, "extracted_data": {}, "summary": summary, "error": error, **fields}
+
+
+def _normalize_document_text(text: str) -> str:
+    """
+    Normalizza gli spazi del testo di un documento mantenendo la struttura delle righe
+    
+    Args:
+        text: Testo estratto da OCR o PDF
+        
+    Returns:
+        Testo con spazi singoli, senza spazi a inizio/fine riga e al massimo una riga vuota di seguito
+    """
+    text = _HSPACE_RE.sub(" ", text)
+    text = _LINE_EDGE_RE.sub("\n", text)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def _encode_image_data_url(image_path: str) -> bytearray:
+    """
+    Codifica un'immagine come data URL base64, leggendola a blocchi
+    
+    Args:
+        image_path: Percorso dell'immagine
+        
+    Returns:
+        Data URL dell'immagine in byte ASCII (non richiede escape JSON)
+    """
+    # Il file non viene mai caricato per intero: ogni blocco è codificato e accodato al buffer
+    data_url = bytearray(_IMAGE_DATA_URL_PREFIX)
+    with open(image_path, "rb") as image_file:
+        while chunk := image_file.read(_BASE64_READ_CHUNK):
+            data_url += base64.b64encode(chunk)
+    return data_url
+
+
+def _truncate_document_text(text: str, max_chars: int) -> str:
+    """
+    Limita il testo al budget di caratteri, tagliando a fine riga o parola
+    
+    Args:
+        text: Testo normalizzato del documento
+        max_chars: Numero massimo di caratteri
+        
+    Returns:
+        Testo entro il budget, senza parole troncate a metà
+    """
+    if len(text) <= max_chars:
+        return text
+    
+    # Preferisci la fine di una riga, poi di una parola, purché non si perda
+    # più di un quinto del budget; altrimenti taglia esattamente al limite
+    min_cut = max_chars * 4 // 5
+    cut = text.rfind("\n", 0, max_chars + 1)
+    if cut < min_cut:
+        cut = text.rfind(" ", 0, max_chars + 1)
+    if cut < min_cut or cut <= 0:
+        cut = max_chars
+    return text[:cut]
+
 
 class LLMService:
     """Servizio per l'integrazione con Mistral tramite OpenRouter"""
@@ -21,137 +181,227 @@ class LLMService:
         self.model = settings.LLM_MODEL
         self.timeout = settings.LLM_TIMEOUT
         
-        logger.info(f"LLM Service inizializzato con modello: {self.model}")
+        # Client HTTP persistente: le chiamate riusano le connessioni keep-alive
+        # invece di rifare handshake TCP e TLS ad ogni richiesta
+        self._client = httpx.AsyncClient(
+            base_url=self.api_url,
+            headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+            timeout=self.timeout,
+            limits=_HTTP_LIMITS
+        )
+        
+        # Risposte già ottenute per richieste identiche (stesso modello, messaggi e parametri)
+        self.cache = LLMCache(settings.LLM_CACHE_MAX_ENTRIES, settings.LLM_CACHE_TTL_SECONDS)
+        
+        # Limite alle richieste HTTP contemporanee verso il provider, per worker
+        self._request_slots = asyncio.Semaphore(settings.LLM_MAX_CONCURRENT_REQUESTS)
+        
+        # Richieste in corso per chiave di cache: le richieste identiche concorrenti ne condividono l'esito
+        self._inflight: Dict[str, "asyncio.Task[Dict[str, Any]]"] = {}
+        
+        logger.info("LLM Service inizializzato con modello: {}", self.model)
+    
+    async def close(self) -> None:
+        """Chiude il client HTTP e le connessioni aperte"""
+        await self._client.aclose()
+    
+    async def _post_chat_completion(self, body: bytes, cache_key: str) -> Dict[str, Any]:
+        """
+        Invia una richiesta chat/completions, unendola a un'eventuale richiesta identica già in corso
+        
+        Args:
+            body: Corpo JSON della richiesta
+            cache_key: Chiave di cache del corpo
+            
+        Returns:
+            Risposta dell'API come dizionario
+        """
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(self._send_chat_completion(body))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda done: self._forget_inflight(cache_key, done))
+        else:
+            logger.info("Richiesta LLM identica già in corso, in attesa della sua risposta")
+        
+        # shield: se una delle richieste in attesa viene annullata, la chiamata condivisa prosegue
+        return await asyncio.shield(task)
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((httpx.RequestError, httpx.TimeoutException))
-    )
-    async def call_llm_api(self, prompt: str) -> Dict[str, Any]:
+    def _cache_response(self, cache_key: str, result: Dict[str, Any]) -> None:
+        """
+        Salva in cache una risposta solo se il suo contenuto è un JSON valido
+        
+        Args:
+            cache_key: Chiave di cache del corpo della richiesta
+            result: Risposta dell'API
+        """
+        # Una risposta non analizzabile darebbe il risultato di fallback per tutto il TTL
+        try:
+            orjson.loads(result["choices"][0]["message"]["content"])
+        except (KeyError, IndexError, TypeError, orjson.JSONDecodeError):
+            logger.warning("Risposta LLM con contenuto non JSON, non salvata in cache")
+            return
+        
+        self.cache.set(cache_key, result)
+    
+    def _forget_inflight(self, cache_key: str, task: "asyncio.Task[Dict[str, Any]]") -> None:
+        """Rimuove una richiesta conclusa dalla mappa di quelle in corso"""
+        self._inflight.pop(cache_key, None)
+        
+        # Segna l'eventuale errore come letto anche se nessuno è rimasto in attesa
+        if not task.cancelled():
+            task.exception()
+    
+    async def _send_chat_completion(self, body: bytes) -> Dict[str, Any]:
+        """
+        Invia una richiesta chat/completions, ritentando gli errori di rete e i timeout
+        
+        Args:
+            body: Corpo JSON della richiesta
+            
+        Returns:
+            Risposta dell'API come dizionario
+        """
+        for attempt in range(1, _LLM_MAX_ATTEMPTS + 1):
+            try:
+                # Lo slot è occupato solo durante l'invio, non durante l'attesa tra i tentativi
+                async with self._request_slots:
+                    response = await self._client.post("/chat/completions", content=body)
+                break
+            except httpx.RequestError as e:
+                if attempt == _LLM_MAX_ATTEMPTS:
+                    raise
+                wait = min(_LLM_RETRY_MAX_WAIT, max(_LLM_RETRY_MIN_WAIT, 2 ** (attempt - 1)))
+                logger.warning("Errore di rete verso l'API LLM: {}, nuovo tentativo tra {}s", e, wait)
+                await asyncio.sleep(wait)
+        
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    
+    async def call_llm_api(self, prompt: str, system_prompt: Optional[str] = None) -> Dict[str, Any]:
         """
         Chiama l'API LLM con il prompt specificato
         
         Args:
             prompt: Prompt da inviare all'LLM
+            system_prompt: Istruzioni statiche inviate prima del prompt (opzionale)
             
         Returns:
             Risposta dell'LLM come dizionario
         """
         try:
-            logger.info(f"Chiamata API LLM con prompt di {len(prompt)} caratteri")
+            logger.info("Chiamata API LLM con prompt di {} caratteri", len(prompt))
             
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            messages = [{"role": "user", "content": prompt}]
+            if system_prompt:
+                messages.insert(0, {"role": "system", "content": system_prompt})
             
             payload = {
                 "model": self.model,
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ],
+                "messages": messages,
                 "max_tokens": 1024,
                 "temperature": 0.1,  # Bassa temperatura per output più deterministici
                 "response_format": {"type": "json_object"}  # Richiedi output in formato JSON
             }
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                logger.info(f"Risposta API LLM ricevuta, {len(result['choices'][0]['message']['content'])} caratteri")
-                return result
+            # Corpo serializzato con orjson una sola volta, usato anche per la chiave di cache
+            body = orjson.dumps(payload)
+            
+            # Con temperatura bassa una richiesta identica dà la stessa risposta: riusala
+            cache_key = self.cache.make_key(body)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("Risposta API LLM dalla cache")
+                return cached
+            
+            result = await self._post_chat_completion(body, cache_key)
+            self._cache_response(cache_key, result)
+            
+            logger.info("Risposta API LLM ricevuta, {} caratteri", len(result['choices'][0]['message']['content']))
+            return result
         except httpx.RequestError as e:
-            logger.error(f"Errore di richiesta API LLM: {e}")
+            logger.error("Errore di richiesta API LLM: {}", e)
             raise
         except httpx.HTTPStatusError as e:
-            logger.error(f"Errore HTTP API LLM: {e}, Status Code: {e.response.status_code}")
-            logger.error(f"Risposta errore: {e.response.text}")
+            logger.error("Errore HTTP API LLM: {}, Status Code: {}", e, e.response.status_code)
+            logger.error("Risposta errore: {}", e.response.text)
             raise
         except Exception as e:
-            logger.error(f"Errore generico API LLM: {e}")
+            logger.error("Errore generico API LLM: {}", e)
             raise
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((httpx.RequestError, httpx.TimeoutException))
-    )
-    async def analyze_image(self, image_path: str, prompt: str) -> Dict[str, Any]:
+    async def analyze_image(self, image_path: str, prompt: str, system_prompt: Optional[str] = None) -> Dict[str, Any]:
         """
         Analizza un'immagine usando l'API di visione di Mistral
         
         Args:
             image_path: Percorso dell'immagine
             prompt: Prompt da inviare all'LLM
+            system_prompt: Istruzioni statiche inviate prima dell'immagine (opzionale)
             
         Returns:
             Risposta dell'LLM come dizionario
         """
         try:
-            logger.info(f"Analisi immagine con Mistral Vision: {image_path}")
-            
-            # Leggi l'immagine e convertila in base64
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode("utf-8")
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            logger.info("Analisi immagine con Mistral Vision: {}", image_path)
+            
+            # Leggi l'immagine e convertila in data URL base64 in un thread, senza bloccare l'event loop
+            image_data_url = await asyncio.to_thread(_encode_image_data_url, image_path)
+            
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": _IMAGE_URL_PLACEHOLDER
+                            }
+                        },
+                        {
+                            "type": "text",
+                            "text": prompt
+                        }
+                    ]
+                }
+            ]
+            if system_prompt:
+                messages.insert(0, {"role": "system", "content": system_prompt})
             
             payload = {
                 "model": self.model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ],
+                "messages": messages,
                 "max_tokens": 1024,
                 "temperature": 0.1,  # Bassa temperatura per output più deterministici
                 "response_format": {"type": "json_object"}  # Richiedi output in formato JSON
             }
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                logger.info(f"Risposta analisi immagine ricevuta, {len(result['choices'][0]['message']['content'])} caratteri")
-                return result
+            # Corpo serializzato con orjson attorno al segnaposto, in cui vengono poi copiati
+            # direttamente i byte del data URL: l'immagine codificata non diventa mai una str
+            head, tail = orjson.dumps(payload).split(_IMAGE_URL_PLACEHOLDER_JSON, 1)
+            body = b"".join((head, b'"', image_data_url, b'"', tail))
+            
+            # Con temperatura bassa una richiesta identica dà la stessa risposta: riusala
+            cache_key = self.cache.make_key(body)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("Risposta analisi immagine dalla cache")
+                return cached
+            
+            result = await self._post_chat_completion(body, cache_key)
+            self._cache_response(cache_key, result)
+            
+            logger.info("Risposta analisi immagine ricevuta, {} caratteri", len(result['choices'][0]['message']['content']))
+            return result
         except httpx.RequestError as e:
-            logger.error(f"Errore di richiesta analisi immagine: {e}")
+            logger.error("Errore di richiesta analisi immagine: {}", e)
             raise
         except httpx.HTTPStatusError as e:
-            logger.error(f"Errore HTTP analisi immagine: {e}, Status Code: {e.response.status_code}")
-            logger.error(f"Risposta errore: {e.response.text}")
+            logger.error("Errore HTTP analisi immagine: {}, Status Code: {}", e, e.response.status_code)
+            logger.error("Risposta errore: {}", e.response.text)
             raise
         except Exception as e:
-            logger.error(f"Errore generico analisi immagine: {e}")
+            logger.error("Errore generico analisi immagine: {}", e)
             raise
     
     async def analyze_document_text(self, text: str, document_type_hint: Optional[DocumentType] = None) -> Dict[str, Any]:
@@ -166,76 +416,32 @@ class LLMService:
             Risultati dell'analisi
         """
         try:
-            logger.info(f"Analisi testo documento con LLM, {len(text)} caratteri")
-            
-            # Costruisci il prompt
-            prompt = """
-            Analizza il seguente documento di business e crea un riassunto strutturato in formato JSON.
-            
-            Identifica il tipo di documento tra: fattura, bilancio, magazzino, corrispettivo, analisi_mercato.
-            
-            Estrai tutti i dettagli rilevanti in base al tipo di documento.
-            
-            Documento:
-            """
+            logger.info("Analisi testo documento con LLM, {} caratteri", len(text))
             
-            # Aggiungi suggerimento sul tipo di documento se fornito
-            if document_type_hint:
-                prompt += f"\n\nSuggerimento: Questo documento potrebbe essere di tipo {document_type_hint.value}."
-                
-            # Aggiungi il testo del documento
-            prompt += f"\n\n{text[:8000]}"  # Limita a 8000 caratteri per evitare token eccessivi
+            # Testi che differiscono solo per gli spazi (es. OCR ripetuto) producono lo stesso
+            # prompt, e quindi la stessa chiave nella cache delle risposte
+            text = _normalize_document_text(text)
             
-            # Aggiungi istruzioni sul formato di output
-            prompt += """
-            
-            Restituisci la risposta in formato JSON con la seguente struttura:
-            {
-                "document_type": "fattura|bilancio|magazzino|corrispettivo|analisi_mercato",
-                "confidence_score": 0.95, // Livello di confidenza nell'identificazione del tipo
-                "extracted_data": {
-                    // Campi specifici in base al tipo di documento
-                },
-                "summary": "Breve riassunto del documento"
-            }
-            
-            Se il documento è una fattura, includi: numero_fattura, data_fattura, importo_totale, iva, mittente, destinatario, righe_fattura, valuta.
-            Se è un bilancio, includi: tipo_bilancio, periodo, attivita, passivita, patrimonio_netto, ricavi, costi, utile_perdita.
-            Se è un documento di magazzino, includi: tipo_documento, data, articoli, totale_quantita, totale_valore, magazzino_codice.
-            Se è un corrispettivo, includi: numero_documento, data, importo_totale, iva, esercente, prodotti.
-            Se è un'analisi di mercato, includi: titolo, periodo, settore, dati_analitici, grafici_descrizioni, conclusioni.
-            
-            Assicurati che il JSON sia ben formato e valido.
-            """
+            # Parte dinamica del prompt: intestazione precalcolata per il suggerimento e testo del documento
+            # (le istruzioni sono nel prompt di sistema), entro il budget di caratteri per evitare token eccessivi
+            prompt = _TEXT_PROMPT_HEADS[document_type_hint] + _truncate_document_text(text, settings.LLM_MAX_DOCUMENT_CHARS)
             
             # Chiama l'API LLM
-            result = await self.call_llm_api(prompt)
+            result = await self.call_llm_api(prompt, _TEXT_SYSTEM_PROMPT)
             
             # Estrai il contenuto JSON dalla risposta
             try:
                 content = result["choices"][0]["message"]["content"]
-                analysis = json.loads(content)
-                logger.info(f"Analisi documento completata, tipo: {analysis.get('document_type', 'sconosciuto')}")
+                analysis = orjson.loads(content)
+                logger.info("Analisi documento completata, tipo: {}", analysis.get('document_type', 'sconosciuto'))
                 return analysis
-            except json.JSONDecodeError as e:
-                logger.error(f"Errore nel parsing JSON dalla risposta LLM: {e}")
-                logger.error(f"Contenuto risposta: {content}")
-                return {
-                    "document_type": "sconosciuto",
-                    "confidence_score": 0.0,
-                    "extracted_data": {},
-                    "summary": "Impossibile analizzare il documento",
-                    "error": "Errore nel parsing JSON"
-                }
+            except orjson.JSONDecodeError as e:
+                logger.error("Errore nel parsing JSON dalla risposta LLM: {}", e)
+                logger.error("Contenuto risposta: {}", content)
+                return _fallback_analysis("Impossibile analizzare il documento", "Errore nel parsing JSON")
         except Exception as e:
-            logger.error(f"Errore durante l'analisi del documento: {e}")
-            return {
-                "document_type": "sconosciuto",
-                "confidence_score": 0.0,
-                "extracted_data": {},
-                "summary": "Errore durante l'analisi del documento",
-                "error": str(e)
-            }
+            logger.error("Errore durante l'analisi del documento: {}", e)
+            return _fallback_analysis("Errore durante l'analisi del documento", str(e))
     
     async def analyze_document_image(self, image_path: str, document_type_hint: Optional[DocumentType] = None) -> Dict[str, Any]:
         """
@@ -249,71 +455,21 @@ class LLMService:
             Risultati dell'analisi
         """
         try:
-            logger.info(f"Analisi immagine documento con Mistral Vision: {image_path}")
+            logger.info("Analisi immagine documento con Mistral Vision: {}", image_path)
             
-            # Costruisci il prompt
-            prompt = """
-            Analizza questa immagine di un documento di business e crea un riassunto strutturato in formato JSON.
-            
-            Identifica il tipo di documento tra: fattura, bilancio, magazzino, corrispettivo, analisi_mercato.
-            
-            Estrai tutti i dettagli rilevanti in base al tipo di documento.
-            """
-            
-            # Aggiungi suggerimento sul tipo di documento se fornito
-            if document_type_hint:
-                prompt += f"\n\nSuggerimento: Questo documento potrebbe essere di tipo {document_type_hint.value}."
-            
-            # Aggiungi istruzioni sul formato di output
-            prompt += """
-            
-            Restituisci la risposta in formato JSON con la seguente struttura:
-            {
-                "document_type": "fattura|bilancio|magazzino|corrispettivo|analisi_mercato",
-                "confidence_score": 0.95, // Livello di confidenza nell'identificazione del tipo
-                "extracted_data": {
-                    // Campi specifici in base al tipo di documento
-                },
-                "raw_text": "Testo estratto dall'immagine",
-                "summary": "Breve riassunto del documento"
-            }
-            
-            Se il documento è una fattura, includi: numero_fattura, data_fattura, importo_totale, iva, mittente, destinatario, righe_fattura, valuta.
-            Se è un bilancio, includi: tipo_bilancio, periodo, attivita, passivita, patrimonio_netto, ricavi, costi, utile_perdita.
-            Se è un documento di magazzino, includi: tipo_documento, data, articoli, totale_quantita, totale_valore, magazzino_codice.
-            Se è un corrispettivo, includi: numero_documento, data, importo_totale, iva, esercente, prodotti.
-            Se è un'analisi di mercato, includi: titolo, periodo, settore, dati_analitici, grafici_descrizioni, conclusioni.
-            
-            Assicurati che il JSON sia ben formato e valido.
-            """
-            
-            # Chiama l'API di analisi immagine
-            result = await self.analyze_image(image_path, prompt)
+            # Chiama l'API di analisi immagine con il prompt precalcolato per il suggerimento
+            result = await self.analyze_image(image_path, _IMAGE_PROMPTS[document_type_hint], _IMAGE_SYSTEM_PROMPT)
             
             # Estrai il contenuto JSON dalla risposta
             try:
                 content = result["choices"][0]["message"]["content"]
-                analysis = json.loads(content)
-                logger.info(f"Analisi immagine documento completata, tipo: {analysis.get('document_type', 'sconosciuto')}")
+                analysis = orjson.loads(content)
+                logger.info("Analisi immagine documento completata, tipo: {}", analysis.get('document_type', 'sconosciuto'))
                 return analysis
-            except json.JSONDecodeError as e:
-                logger.error(f"Errore nel parsing JSON dalla risposta Mistral Vision: {e}")
-                logger.error(f"Contenuto risposta: {content}")
-                return {
-                    "document_type": "sconosciuto",
-                    "confidence_score": 0.0,
-                    "extracted_data": {},
-                    "raw_text": "",
-                    "summary": "Impossibile analizzare il documento",
-                    "error": "Errore nel parsing JSON"
-                }
+            except orjson.JSONDecodeError as e:
+                logger.error("Errore nel parsing JSON dalla risposta Mistral Vision: {}", e)
+                logger.error("Contenuto risposta: {}", content)
+                return _fallback_analysis("Impossibile analizzare il documento", "Errore nel parsing JSON", raw_text="")
         except Exception as e:
-            logger.error(f"Errore durante l'analisi dell'immagine documento: {e}")
-            return {
-                "document_type": "sconosciuto",
-                "confidence_score": 0.0,
-                "extracted_data": {},
-                "raw_text": "",
-                "summary": "Errore durante l'analisi dell'immagine documento",
-                "error": str(e)
-            }
+            logger.error("Errore durante l'analisi dell'immagine documento: {}", e)
+            return _fallback_analysis("Errore durante l'analisi dell'immagine documento", str(e), raw_text="")
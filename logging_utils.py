@@ -1,6 +1,5 @@
 import sys
 import json
-from datetime import datetime
 from pathlib import Path
 from loguru import logger
 import logging
@@ -81,7 +80,10 @@ def setup_logging():
 
 def get_logger(name: str):
     """
-    Ottiene un logger configurato per il modulo specificato
+    Ottiene un logger configurato per il modulo specificato.
+    
+    Passare i valori come argomenti ("File: {}", path) invece di usare f-string:
+    Loguru formatta il messaggio solo se il livello è abilitato.
     """
     return logger.bind(module=name)
 
@@ -89,13 +91,15 @@ def get_logger(name: str):
 def log_request(request_id: str, endpoint: str, metadata: Dict[str, Any]):
     """
     Registra informazioni sulla richiesta
+    
+    L'istante dell'evento è già nel record di Loguru (record["time"], serializzato
+    nei log JSON): i campi extra non ripetono il timestamp.
     """
     logger.info(
-        f"Richiesta ricevuta: {endpoint}", 
+        "Richiesta ricevuta: {endpoint}", 
         request_id=request_id,
         endpoint=endpoint,
-        metadata=metadata,
-        timestamp=datetime.now().isoformat()
+        metadata=metadata
     )
 
 
@@ -104,12 +108,11 @@ def log_response(request_id: str, endpoint: str, status_code: int, processing_ti
     Registra informazioni sulla risposta
     """
     logger.info(
-        f"Risposta inviata: {endpoint}", 
+        "Risposta inviata: {endpoint}", 
         request_id=request_id,
         endpoint=endpoint,
         status_code=status_code,
-        processing_time_ms=processing_time_ms,
-        timestamp=datetime.now().isoformat()
+        processing_time_ms=processing_time_ms
     )
 
 
@@ -118,12 +121,11 @@ def log_error(request_id: str, endpoint: str, error_msg: str, error_details: Dic
     Registra informazioni sugli errori
     """
     logger.error(
-        f"Errore in {endpoint}: {error_msg}", 
+        "Errore in {endpoint}: {error_msg}", 
         request_id=request_id,
         endpoint=endpoint,
         error_msg=error_msg,
-        error_details=error_details,
-        timestamp=datetime.now().isoformat()
+        error_details=error_details
     )
 
 
@@ -1,133 +1,294 @@
+import asyncio
 import json
 import os
 import time
-import uuid
+import orjson
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Dict, Any, Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request, Depends, Form
-from fastapi.responses import JSONResponse
-from fastapi.middleware.cors import CORSMiddleware
-import psutil
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Depends, Form, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import ValidationError
 
-from app.config.settings import settings
+from app.config.settings import settings, Environment, MAX_FILE_SIZE_BYTES
 from app.models.document import ProcessingRequest, DocumentType
 from app.models.response import (
-    HealthResponse, 
     ErrorResponse, 
     ProcessDocumentResponse,
     WebhookTestResponse
 )
 from app.services.document_processor import DocumentProcessor
-from app.utils.file_utils import save_upload_file, cleanup_temp_directory
+from app.services.pdf_processor import set_ocr_page_workers
+from app.utils.file_utils import (
+    FileTooLargeError,
+    save_upload_file,
+    cleanup_temp_directory,
+    cleanup_stale_worker_dirs,
+    init_worker_temp_dir,
+    start_cleanup_worker,
+    stop_cleanup_worker
+)
 from app.utils.validators import validate_file
+from app.utils.cors import SimpleCORSMiddleware
+from app.utils.cpu_utils import available_cpus
+from app.utils.json_utils import AppJSONResponse, dumps as json_dumps
+from app.utils.id_utils import new_hex_id
 from app.utils.logging_utils import get_logger, log_request, log_response, log_error
 
 logger = get_logger(__name__)
 
+# Impostazioni usate nei percorsi caldi, lette una sola volta dal BaseSettings
+APP_NAME = settings.APP_NAME
+APP_VERSION = settings.APP_VERSION
+ENVIRONMENT = settings.ENVIRONMENT
+SLOW_REQUEST_THRESHOLD_MS = settings.SLOW_REQUEST_THRESHOLD_MS
+MAX_FILE_SIZE_MB = settings.MAX_FILE_SIZE_MB
+
+# Documentazione interattiva e schema OpenAPI solo fuori dalla produzione
+DOCS_ENABLED = ENVIRONMENT != Environment.PRODUCTION
+
+# Margine per i campi del form multipart oltre al file vero e proprio
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+MAX_REQUEST_BODY_BYTES = MAX_FILE_SIZE_BYTES + MULTIPART_OVERHEAD_BYTES
+
+# Job CPU-bound ammessi in coda nel pool per ogni processo disponibile
+POOL_PENDING_PER_WORKER = 2
+
+# Ciclo di vita dell'applicazione: eseguito una volta per processo worker
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Eventi da eseguire all'avvio e alla chiusura dell'applicazione
+    """
+    global start_ns
+    
+    # Ogni worker uvicorn è un processo separato: uptime e PID sono per worker
+    start_ns = time.perf_counter_ns()
+    _HEALTH_STATIC["worker_pid"] = os.getpid()
+    
+    logger.info("Avvio del servizio {} v{} in ambiente {} (worker PID {})", APP_NAME, APP_VERSION, ENVIRONMENT, os.getpid())
+    
+    # Pulisci le cartelle dei worker terminati e crea quella di questo worker
+    cleanup_stale_worker_dirs()
+    worker_temp_dir = init_worker_temp_dir()
+    logger.info("Cartella temporanea creata: {}", worker_temp_dir)
+    
+    # Genera subito lo schema OpenAPI: FastAPI lo conserva in app.openapi_schema,
+    # così la prima richiesta a /docs non paga la visita di tutti i modelli
+    if DOCS_ENABLED:
+        app.openapi()
+    
+    # Avvia la pulizia in background dei file temporanei delle richieste
+    start_cleanup_worker()
+    
+    # Pool di processi per OCR ed estrazione PDF, fuori dall'event loop: le CPU
+    # del container sono divise tra i worker uvicorn, che hanno ciascuno un pool
+    cpus = available_cpus()
+    pool_workers = settings.PROCESS_POOL_WORKERS or max(1, cpus // settings.WEB_CONCURRENCY)
+    
+    # OCR in parallelo sulle pagine solo con le CPU non già occupate dai processi del pool
+    page_workers = settings.PDF_OCR_PAGE_WORKERS or max(1, cpus // (settings.WEB_CONCURRENCY * pool_workers))
+    app.state.pool = ProcessPoolExecutor(
+        max_workers=pool_workers,
+        initializer=set_ocr_page_workers,
+        initargs=(page_workers,)
+    )
+    document_processor.executor = app.state.pool
+    
+    # Backpressure: le richieste in eccesso attendono invece di accumularsi nella coda del pool
+    document_processor.executor_slots = asyncio.Semaphore(pool_workers * POOL_PENDING_PER_WORKER)
+    
+    yield
+    
+    logger.info("Arresto del servizio {}", APP_NAME)
+    
+    # Chiudi il pool di processi
+    document_processor.executor = None
+    document_processor.executor_slots = None
+    app.state.pool.shutdown(wait=True, cancel_futures=True)
+    
+    # Chiudi le connessioni verso l'API LLM
+    await document_processor.llm_service.close()
+    
+    # Ferma la pulizia in background e svuota la coda
+    await stop_cleanup_worker()
+    
+    # Elimina la cartella temporanea del worker
+    cleanup_temp_directory(recreate=False)
+
+
 # Crea l'app FastAPI
 app = FastAPI(
-    title=settings.APP_NAME,
-    version=settings.APP_VERSION,
-    description="API per il processamento di documenti business (immagini e PDF)"
+    title=APP_NAME,
+    version=APP_VERSION,
+    description="API per il processamento di documenti business (immagini e PDF)",
+    default_response_class=AppJSONResponse,
+    docs_url="/docs" if DOCS_ENABLED else None,
+    redoc_url="/redoc" if DOCS_ENABLED else None,
+    openapi_url="/openapi.json" if DOCS_ENABLED else None,
+    lifespan=lifespan
 )
 
-# Aggiungi middleware CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In produzione, specificare le origini consentite
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Variabili globali per monitorare lo stato del servizio
-start_time = time.time()
+# Variabili globali per monitorare lo stato del servizio (per processo worker)
+start_ns = time.perf_counter_ns()
 document_processor = DocumentProcessor()
 
+# Parte statica della risposta di health check, calcolata una sola volta
+HEALTH_CACHE_TTL_NS = 1_000_000_000
+_HEALTH_STATIC = {
+    "status": "ok",
+    "version": APP_VERSION,
+    "environment": ENVIRONMENT.value,
+    "worker_pid": os.getpid(),
+    "api_connections": {
+        "openrouter": True  # Semplificato per il health check
+    }
+}
+_health_body = b""
+# Valore iniziale che forza il calcolo alla prima richiesta
+_health_cached_at_ns = -HEALTH_CACHE_TTL_NS
+
+
+def request_now(request: Request) -> datetime:
+    """
+    Restituisce il timestamp della richiesta, calcolato una sola volta
+    
+    Args:
+        request: Richiesta corrente
+        
+    Returns:
+        Timestamp condiviso da tutti gli oggetti di risposta della richiesta
+    """
+    now = getattr(request.state, "now", None)
+    if now is None:
+        now = request.state.now = datetime.now()
+    return now
+
+
+def file_too_large_response(request: Request) -> AppJSONResponse:
+    """
+    Risposta 413 per upload oltre la dimensione massima consentita
+    
+    Args:
+        request: Richiesta corrente
+        
+    Returns:
+        Risposta con la forma di ErrorResponse, uguale per tutti i controlli sulla dimensione
+    """
+    error_response = ErrorResponse(
+        timestamp=request_now(request),
+        error_code="file_too_large",
+        message=f"Il file supera la dimensione massima consentita di {MAX_FILE_SIZE_MB}MB"
+    )
+    
+    return AppJSONResponse(
+        status_code=413,
+        content=error_response.model_dump()
+    )
+
+
+# Upload troppo grandi scoperti durante la validazione o la copia su disco
+@app.exception_handler(FileTooLargeError)
+async def file_too_large_handler(request: Request, exc: FileTooLargeError):
+    return file_too_large_response(request)
+
 
 # Middleware per catturare errori globali
 @app.middleware("http")
 async def error_handling_middleware(request: Request, call_next):
-    request_id = str(uuid.uuid4())
+    # Rifiuta le richieste troppo grandi prima di leggerne il body
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_REQUEST_BODY_BYTES:
+        logger.warning("Richiesta rifiutata, body troppo grande: {} bytes", content_length)
+        return file_too_large_response(request)
+    
+    request_start_ns = time.perf_counter_ns()
     
     try:
         response = await call_next(request)
+        
+        # Segnala le richieste lente (es. chiamate bloccanti nell'event loop)
+        elapsed_ms = (time.perf_counter_ns() - request_start_ns) // 1_000_000
+        if elapsed_ms > SLOW_REQUEST_THRESHOLD_MS:
+            logger.warning("Richiesta lenta: {} {}, tempo: {}ms", request.method, request.url.path, elapsed_ms)
+        
         return response
     except Exception as e:
-        logger.exception(f"Errore non gestito: {e}")
+        logger.exception("Errore non gestito: {}", e)
         
         error_response = ErrorResponse(
+            timestamp=request_now(request),
             error_code="server_error",
             message="Si è verificato un errore interno del server",
             details={"error": str(e)}
         )
         
-        return JSONResponse(
+        return AppJSONResponse(
             status_code=500,
-            content=error_response.dict()
+            content=error_response.model_dump()
         )
 
 
-# Endpoint di health check
-@app.get("/health", response_model=HealthResponse, tags=["System"])
-async def health_check():
+# L'ultimo middleware registrato è il più esterno: CORS avvolge tutto il resto,
+# comprese le risposte di errore prodotte dal middleware qui sopra
+
+# Compressione solo per le risposte oltre 1KB (health check e errori restano in chiaro)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Middleware CORS con header precalcolati (tutte le origini consentite)
+app.add_middleware(SimpleCORSMiddleware, allow_credentials=True)
+
+
+# Endpoint di health check: route Starlette semplice, senza dependency injection
+# né response_model di FastAPI (viene interrogato di continuo dai probe)
+async def health_check(request: Request) -> Response:
     """
     Verifica lo stato del servizio
     """
-    # Calcola l'uptime
-    uptime_seconds = int(time.time() - start_time)
+    global _health_body, _health_cached_at_ns
     
-    # Verifica connessioni API esterne
-    api_connections = {
-        "openrouter": True  # Semplificato per il health check
-    }
+    # Ricalcola e serializza la risposta al massimo una volta per intervallo di cache
+    now_ns = time.perf_counter_ns()
+    if now_ns - _health_cached_at_ns >= HEALTH_CACHE_TTL_NS:
+        _health_body = json_dumps({
+            **_HEALTH_STATIC,
+            "timestamp": datetime.now(),
+            "uptime_seconds": (now_ns - start_ns) // 1_000_000_000
+        })
+        _health_cached_at_ns = now_ns
     
-    return HealthResponse(
-        status="ok",
-        version=settings.APP_VERSION,
-        environment=settings.ENVIRONMENT,
-        api_connections=api_connections,
-        uptime_seconds=uptime_seconds
-    )
-    
-    # Informazioni di sistema
-    cpu_percent = psutil.cpu_percent()
-    memory_info = psutil.virtual_memory()
-    
-    return HealthResponse(
-        status="ok",
-        version=settings.APP_VERSION,
-        environment=settings.ENVIRONMENT,
-        api_connections=api_connections,
-        uptime_seconds=uptime_seconds,
-        system_info={
-            "cpu_percent": cpu_percent,
-            "memory_percent": memory_info.percent,
-            "available_memory_mb": memory_info.available / (1024 * 1024)
-        }
-    )
+    return Response(content=_health_body, media_type="application/json")
+
+
+app.add_route("/health", health_check, methods=["GET"], include_in_schema=False)
 
 
 # Endpoint per il processamento di documenti
 @app.post("/process-document", response_model=ProcessDocumentResponse, tags=["Document"])
 async def process_document(
+    request: Request,
     file: UploadFile = File(...),
     document_type: Optional[str] = Form(None),
-    custom_metadata: Optional[str] = Form(None),
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    custom_metadata: Optional[str] = Form(None)
 ):
     """
     Processa un documento (immagine o PDF) ed estrae informazioni strutturate
     """
-    request_id = str(uuid.uuid4())
-    start_time = time.time()
+    # Riferimenti locali per evitare ricerche ripetute di attributi e globali
+    _now_ns = time.perf_counter_ns
+    endpoint = "/process-document"
+    filename = file.filename
+    
+    request_id = new_hex_id()
+    start_ns = _now_ns()
     
     try:
         # Log della richiesta
         log_request(
             request_id=request_id,
-            endpoint="/process-document",
-            metadata={"filename": file.filename, "document_type": document_type}
+            endpoint=endpoint,
+            metadata={"filename": filename, "document_type": document_type}
         )
         
         # Valida il file
@@ -135,7 +296,6 @@ async def process_document(
         
         # Crea la richiesta di processamento
         processing_request = ProcessingRequest(
-            document_id=str(uuid.uuid4()),
             document_type_hint=DocumentType(document_type) if document_type else None,
             custom_metadata=json.loads(custom_metadata) if custom_metadata else None
         )
@@ -143,6 +303,10 @@ async def process_document(
         # Salva il file
         file_path, md5_hash, file_size = await save_upload_file(file)
         
+        # Il documento è ormai su disco: libera subito lo spool dell'upload
+        # invece di tenerlo aperto per tutta la durata dell'elaborazione
+        await file.close()
+        
         # Processa il documento
         result = await document_processor.process_document(
             file_path=file_path,
@@ -153,54 +317,94 @@ async def process_document(
         )
         
         # Calcola il tempo di elaborazione
-        processing_time_ms = int((time.time() - start_time) * 1000)
+        processing_time_ms = (_now_ns() - start_ns) // 1_000_000
+        
+        # La risposta riusa il timestamp del risultato invece di rileggere l'orologio
+        request.state.now = result.processing_timestamp
         
-        # Preparazione della risposta
-        response = ProcessDocumentResponse(
+        # Preparazione della risposta: i dati provengono dal processore e sono già
+        # validati, model_construct evita di rivalidare ricorsivamente result_json
+        response = ProcessDocumentResponse.model_construct(
+            timestamp=request_now(request),
             document_id=result.document_id,
             document_type=result.document_type.value,
             confidence_score=result.confidence_score,
             processing_time_ms=processing_time_ms,
-            result_json=result.dict(),
+            result_json=result.model_dump(),
             processing_notes=result.processing_notes
         )
         
         # Log della risposta
         log_response(
             request_id=request_id,
-            endpoint="/process-document",
+            endpoint=endpoint,
             status_code=200,
             processing_time_ms=processing_time_ms
         )
         
-        # Aggiungi task in background per la pulizia periodica
-        background_tasks.add_task(cleanup_temp_directory)
-        
-        return response
+        # Risposta serializzata direttamente con orjson, senza la validazione del response_model
+        return AppJSONResponse(content=response.model_dump())
     except HTTPException as e:
         # Rilancia le eccezioni HTTP già gestite
         log_error(
             request_id=request_id,
-            endpoint="/process-document",
+            endpoint=endpoint,
             error_msg=e.detail,
             error_details={"status_code": e.status_code}
         )
         raise
-    except Exception as e:
-        # Gestione errori generici
+    except (ValueError, ValidationError) as e:
+        # Parametri non validi (document_type sconosciuto, custom_metadata non JSON)
         log_error(
             request_id=request_id,
-            endpoint="/process-document",
+            endpoint=endpoint,
             error_msg=str(e),
-            error_details={"exception": str(type(e).__name__)}
+            error_details={"exception": type(e).__name__}
         )
         
+        raise HTTPException(
+            status_code=400,
+            detail=f"Parametri della richiesta non validi: {str(e)}"
+        )
+    except Exception:
+        # Errore inatteso: il traceback viene formattato una sola volta, nel log
+        logger.exception("Errore durante il processamento del documento, richiesta {}", request_id)
+        
         raise HTTPException(
             status_code=500,
-            detail=f"Errore durante il processamento del documento: {str(e)}"
+            detail="Errore interno durante il processamento del documento"
         )
 
 
+def _webhook_test_response(
+    request: Request,
+    payload_valid: bool,
+    processing_time_ms: int,
+    message: str
+) -> AppJSONResponse:
+    """
+    Costruisce la risposta di /test-webhook senza passare per la validazione Pydantic
+    
+    Args:
+        request: Richiesta corrente
+        payload_valid: Se il body ricevuto è un JSON valido
+        processing_time_ms: Tempo di elaborazione simulato
+        message: Messaggio per il client
+        
+    Returns:
+        Risposta JSON con la stessa forma di WebhookTestResponse
+    """
+    return AppJSONResponse(content={
+        "status": "success",
+        "timestamp": request_now(request),
+        "webhook_received": True,
+        "payload_valid": payload_valid,
+        "simulated_processing_time_ms": processing_time_ms,
+        "test_document_id": new_hex_id(),
+        "message": message
+    })
+
+
 # Endpoint per il test del webhook
 @app.post("/test-webhook", response_model=WebhookTestResponse, tags=["System"])
 async def test_webhook(
@@ -209,8 +413,8 @@ async def test_webhook(
     """
     Endpoint per testare l'integrazione webhook con N8N
     """
-    request_id = str(uuid.uuid4())
-    start_time = time.time()
+    request_id = new_hex_id()
+    start_ns = time.perf_counter_ns()
     
     try:
         # Log della richiesta
@@ -220,23 +424,14 @@ async def test_webhook(
             metadata={}
         )
         
-        # Ottieni il body della richiesta
-        body = await request.json()
+        # Verifica che il body sia un JSON valido (orjson, senza passare per il parser stdlib)
+        orjson.loads(await request.body())
         
-        # Simula un tempo di elaborazione
-        time.sleep(0.5)
+        # Simula un tempo di elaborazione senza bloccare l'event loop
+        await asyncio.sleep(0.5)
         
         # Calcola il tempo di elaborazione
-        processing_time_ms = int((time.time() - start_time) * 1000)
-        
-        # Preparazione della risposta
-        response = WebhookTestResponse(
-            webhook_received=True,
-            payload_valid=True,
-            simulated_processing_time_ms=processing_time_ms,
-            test_document_id=str(uuid.uuid4()),
-            message="Webhook ricevuto e testato con successo"
-        )
+        processing_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
         
         # Log della risposta
         log_response(
@@ -246,7 +441,7 @@ async def test_webhook(
             processing_time_ms=processing_time_ms
         )
         
-        return response
+        return _webhook_test_response(request, True, processing_time_ms, "Webhook ricevuto e testato con successo")
     except Exception as e:
         # Gestione errori
         log_error(
@@ -257,45 +452,36 @@ async def test_webhook(
         )
         
         # Preparazione della risposta di errore
-        response = WebhookTestResponse(
-            webhook_received=True,
-            payload_valid=False,
-            simulated_processing_time_ms=int((time.time() - start_time) * 1000),
-            test_document_id=str(uuid.uuid4()),
-            message=f"Errore durante il test del webhook: {str(e)}"
+        return _webhook_test_response(
+            request,
+            False,
+            (time.perf_counter_ns() - start_ns) // 1_000_000,
+            f"Errore durante il test del webhook: {str(e)}"
         )
-        
-        return response
-
-
-# Eventi di startup e shutdown dell'applicazione
-@app.on_event("startup")
-async def startup_event():
-    """
-    Eventi da eseguire all'avvio dell'applicazione
-    """
-    logger.info(f"Avvio del servizio {settings.APP_NAME} v{settings.APP_VERSION} in ambiente {settings.ENVIRONMENT}")
-    
-    # Verifica la presenza della cartella temporanea
-    os.makedirs(settings.TEMP_FOLDER, exist_ok=True)
-    logger.info(f"Cartella temporanea creata: {settings.TEMP_FOLDER}")
-    
-    # Pulisci eventuali file temporanei residui
-    cleanup_temp_directory()
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """
-    Eventi da eseguire alla chiusura dell'applicazione
-    """
-    logger.info(f"Arresto del servizio {settings.APP_NAME}")
-    
-    # Pulisci la cartella temporanea
-    cleanup_temp_directory()
 
 
 # Punto di ingresso per il server uvicorn
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    
+    # uvloop non è disponibile su Windows: in quel caso uvicorn usa il loop asyncio standard
+    try:
+        import uvloop  # noqa: F401
+        event_loop = "uvloop"
+    except ImportError:
+        event_loop = "asyncio"
+    
+    # Un worker per CPU del container; la variabile resta nell'ambiente dei worker,
+    # che la usano per dimensionare il proprio pool di processi
+    web_concurrency = int(os.environ.setdefault("WEB_CONCURRENCY", str(available_cpus())))
+    
+    # uvloop + httptools al posto di asyncio/h11; niente reload (forza il selector loop)
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop=event_loop,
+        http="httptools",
+        workers=web_concurrency,
+        reload=False
+    )
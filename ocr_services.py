@@ -22,7 +22,9 @@ class OCRService:
                      Default: impostazione da config (ita+eng)
         """
         self.language = language or settings.OCR_LANGUAGE
-        logger.info(f"OCR Service inizializzato con lingua: {self.language}")
+        # Configurazione tesseract costante per il servizio, costruita una sola volta
+        self.ocr_config = f'--oem 3 --psm 6 -l {self.language}'
+        logger.info("OCR Service inizializzato con lingua: {}", self.language)
     
     def extract_text_from_image(self, image_path: str) -> str:
         """
@@ -35,19 +37,19 @@ class OCRService:
             Testo estratto dall'immagine
         """
         try:
-            logger.info(f"Esecuzione OCR su: {image_path}")
+            logger.info("Esecuzione OCR su: {}", image_path)
             
             # Carica l'immagine
             image = Image.open(image_path)
             
             # Esegui OCR con pytesseract
-            ocr_config = f'--oem 3 --psm 6 -l {self.language}'
+            ocr_config = self.ocr_config
             text = pytesseract.image_to_string(image, config=ocr_config)
             
-            logger.info(f"OCR completato per {image_path}, estratti {len(text)} caratteri")
+            logger.info("OCR completato per {}, estratti {} caratteri", image_path, len(text))
             return text
         except Exception as e:
-            logger.error(f"Errore durante l'OCR dell'immagine {image_path}: {e}")
+            logger.error("Errore durante l'OCR dell'immagine {}: {}", image_path, e)
             return ""
     
     def extract_text_from_images(self, image_paths: List[str]) -> str:
@@ -63,12 +65,12 @@ class OCRService:
         all_text = []
         
         for idx, image_path in enumerate(image_paths):
-            logger.info(f"Elaborazione immagine {idx+1}/{len(image_paths)}: {image_path}")
+            logger.info("Elaborazione immagine {}/{}: {}", idx+1, len(image_paths), image_path)
             text = self.extract_text_from_image(image_path)
             all_text.append(text)
         
         combined_text = "\n\n".join(all_text)
-        logger.info(f"OCR completato per {len(image_paths)} immagini, estratti {len(combined_text)} caratteri totali")
+        logger.info("OCR completato per {} immagini, estratti {} caratteri totali", len(image_paths), len(combined_text))
         return combined_text
     
     def get_ocr_data(self, image_path: str) -> Dict[str, Any]:
@@ -82,37 +84,39 @@ class OCRService:
             Dizionario con testo e dati OCR
         """
         try:
-            logger.info(f"Recupero dati OCR da: {image_path}")
+            logger.info("Recupero dati OCR da: {}", image_path)
             
             # Carica l'immagine
             image = Image.open(image_path)
             
             # Esegui OCR con pytesseract per il testo
-            ocr_config = f'--oem 3 --psm 6 -l {self.language}'
+            ocr_config = self.ocr_config
             text = pytesseract.image_to_string(image, config=ocr_config)
             
             # Ottieni dati sulle caselle di testo
             boxes = pytesseract.image_to_data(image, config=ocr_config, output_type=pytesseract.Output.DICT)
             
-            # Ottieni informazioni sulla struttura della pagina
-            hocr_data = pytesseract.image_to_pdf_or_hocr(
-                image, 
-                extension='hocr', 
-                config=ocr_config
-            )
+            # Confidenza media e numero di parole calcolati in un solo passaggio sulle caselle
+            confidences = boxes['conf']
+            conf_total = 0
+            words_count = 0
+            for conf, word in zip(confidences, boxes['text']):
+                conf_total += conf
+                if word.strip():
+                    words_count += 1
             
             ocr_data = {
                 "text": text,
                 "boxes": boxes,
-                "confidence": sum(boxes['conf']) / len(boxes['conf']) if boxes['conf'] else 0,
-                "words_count": len([w for w in boxes['text'] if w.strip()]),
+                "confidence": conf_total / len(confidences) if confidences else 0,
+                "words_count": words_count,
                 "has_text": bool(text.strip())
             }
             
-            logger.info(f"Dati OCR recuperati per {image_path}, confidence: {ocr_data['confidence']:.2f}%")
+            logger.info("Dati OCR recuperati per {}, confidence: {:.2f}%", image_path, ocr_data['confidence'])
             return ocr_data
         except Exception as e:
-            logger.error(f"Errore durante il recupero dei dati OCR da {image_path}: {e}")
+            logger.error("Errore durante il recupero dei dati OCR da {}: {}", image_path, e)
             return {
                 "text": "",
                 "boxes": {},
@@ -1,18 +1,65 @@
 import os
-import uuid
-from pathlib import Path
-from typing import List, Dict, Any, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice, repeat
+from typing import List, Dict, Any, Iterator, Tuple, Optional
 import pypdf
-from pdf2image import convert_from_path
 import tempfile
 
 from app.config.settings import settings
 from app.utils.logging_utils import get_logger
+from app.utils.id_utils import new_hex_id
+from app.utils.file_utils import get_worker_temp_dir
 from app.services.ocr_service import OCRService
 from app.services.image_processor import ImageProcessor
 
 logger = get_logger(__name__)
 
+# Pagine OCR elaborate in parallelo da questo processo, impostate all'avvio del pool
+_ocr_page_workers = settings.PDF_OCR_PAGE_WORKERS or 1
+
+# Campi dei metadati PDF restituiti, con la chiave corrispondente nel dizionario pypdf
+PDF_METADATA_FIELDS = (
+    ("title", "/Title"),
+    ("author", "/Author"),
+    ("subject", "/Subject"),
+    ("creator", "/Creator"),
+    ("producer", "/Producer"),
+    ("creation_date", "/CreationDate"),
+    ("modification_date", "/ModDate")
+)
+
+
+def set_ocr_page_workers(workers: int) -> None:
+    """
+    Imposta le pagine OCR elaborate in parallelo dal processo corrente
+    
+    Args:
+        workers: Numero di pagine passate contemporaneamente a tesseract
+    """
+    global _ocr_page_workers
+    _ocr_page_workers = max(1, workers)
+
+
+@contextmanager
+def _open_pdf(pdf_path: str, pdf_reader: Optional[pypdf.PdfReader] = None) -> Iterator[pypdf.PdfReader]:
+    """
+    Restituisce il reader fornito oppure apre il PDF per la durata del blocco
+    
+    Args:
+        pdf_path: Percorso del file PDF
+        pdf_reader: Reader già aperto sullo stesso file (opzionale)
+        
+    Returns:
+        Reader pypdf del documento
+    """
+    if pdf_reader is not None:
+        yield pdf_reader
+        return
+    
+    with open(pdf_path, 'rb') as file:
+        yield pypdf.PdfReader(file)
+
 
 class PDFProcessor:
     """Servizio per il processamento di file PDF"""
@@ -23,33 +70,31 @@ class PDFProcessor:
         self.image_processor = ImageProcessor()
         logger.info("PDF Processor inizializzato")
     
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
+    def extract_text_from_pdf(self, pdf_path: str, pdf_reader: Optional[pypdf.PdfReader] = None) -> str:
         """
         Estrae il testo da un PDF nativo (con testo selezionabile)
         
         Args:
             pdf_path: Percorso del file PDF
+            pdf_reader: Reader già aperto sul PDF, per non riaprire il file (opzionale)
             
         Returns:
             Testo estratto dal PDF
         """
         try:
-            logger.info(f"Estrazione testo da PDF nativo: {pdf_path}")
+            logger.info("Estrazione testo da PDF nativo: {}", pdf_path)
             
-            # Apri il PDF
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = pypdf.PdfReader(file)
+            # Apri il PDF, o riusa il reader fornito dal chiamante
+            with _open_pdf(pdf_path, pdf_reader) as pdf_reader:
                 
-                # Estrai il testo da ogni pagina
-                text = ""
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n\n"
+                # Estrai il testo da ogni pagina e uniscilo con un solo join
+                page_texts = [page.extract_text() for page in pdf_reader.pages]
+                text = ("\n\n".join(page_texts) + "\n\n") if page_texts else ""
             
-            logger.info(f"Testo estratto da PDF nativo: {pdf_path}, {len(text)} caratteri")
+            logger.info("Testo estratto da PDF nativo: {}, {} caratteri", pdf_path, len(text))
             return text
         except Exception as e:
-            logger.error(f"Errore durante l'estrazione del testo dal PDF nativo {pdf_path}: {e}")
+            logger.error("Errore durante l'estrazione del testo dal PDF nativo {}: {}", pdf_path, e)
             return ""
     
     def convert_pdf_to_images(self, pdf_path: str) -> List[str]:
@@ -63,14 +108,16 @@ class PDFProcessor:
             Lista di percorsi delle immagini generate
         """
         try:
-            logger.info(f"Conversione PDF in immagini: {pdf_path}")
+            logger.info("Conversione PDF in immagini: {}", pdf_path)
             
-            # Crea directory temporanea
-            temp_dir = Path(settings.TEMP_FOLDER)
-            temp_dir.mkdir(parents=True, exist_ok=True)
+            # Cartella temporanea del worker, già creata all'avvio
+            temp_dir = get_worker_temp_dir()
             
             # Genera un prefisso unico per i file
-            prefix = f"pdf_img_{uuid.uuid4()}"
+            prefix = f"pdf_img_{new_hex_id()}"
+            
+            # pdf2image (e poppler) serve solo per i PDF scansionati: import alla prima conversione
+            from pdf2image import convert_from_path
             
             # Converti PDF in immagini
             images = convert_from_path(
@@ -82,98 +129,116 @@ class PDFProcessor:
                 paths_only=True
             )
             
-            logger.info(f"PDF convertito in {len(images)} immagini: {pdf_path}")
+            logger.info("PDF convertito in {} immagini: {}", len(images), pdf_path)
             return images
         except Exception as e:
-            logger.error(f"Errore durante la conversione del PDF in immagini {pdf_path}: {e}")
+            logger.error("Errore durante la conversione del PDF in immagini {}: {}", pdf_path, e)
             return []
     
-    def is_searchable_pdf(self, pdf_path: str) -> bool:
+    def is_searchable_pdf(self, pdf_path: str, pdf_reader: Optional[pypdf.PdfReader] = None) -> bool:
         """
         Verifica se un PDF contiene testo selezionabile
         
         Args:
             pdf_path: Percorso del file PDF
+            pdf_reader: Reader già aperto sul PDF, per non riaprire il file (opzionale)
             
         Returns:
             True se il PDF contiene testo selezionabile, False altrimenti
         """
         try:
-            logger.info(f"Verifica se il PDF è ricercabile: {pdf_path}")
+            logger.info("Verifica se il PDF è ricercabile: {}", pdf_path)
             
-            # Apri il PDF
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = pypdf.PdfReader(file)
+            # Apri il PDF, o riusa il reader fornito dal chiamante
+            with _open_pdf(pdf_path, pdf_reader) as pdf_reader:
                 
                 # Verifica se c'è testo nelle prime pagine
-                for page_num in range(min(3, len(pdf_reader.pages))):
-                    page = pdf_reader.pages[page_num]
+                for page in islice(pdf_reader.pages, 3):
                     text = page.extract_text()
                     
                     # Se c'è almeno 100 caratteri di testo, considera il PDF ricercabile
                     if len(text.strip()) > 100:
-                        logger.info(f"PDF ricercabile: {pdf_path}")
+                        logger.info("PDF ricercabile: {}", pdf_path)
                         return True
             
-            logger.info(f"PDF non ricercabile: {pdf_path}")
+            logger.info("PDF non ricercabile: {}", pdf_path)
             return False
         except Exception as e:
-            logger.error(f"Errore durante la verifica se il PDF è ricercabile {pdf_path}: {e}")
+            logger.error("Errore durante la verifica se il PDF è ricercabile {}: {}", pdf_path, e)
             return False
     
-    def get_pdf_metadata(self, pdf_path: str) -> Dict[str, Any]:
+    def get_pdf_metadata(self, pdf_path: str, pdf_reader: Optional[pypdf.PdfReader] = None) -> Dict[str, Any]:
         """
         Ottiene i metadati da un PDF
         
         Args:
             pdf_path: Percorso del file PDF
+            pdf_reader: Reader già aperto sul PDF, per non riaprire il file (opzionale)
             
         Returns:
             Dizionario con metadati del PDF
         """
         try:
-            logger.info(f"Recupero metadati PDF: {pdf_path}")
+            logger.info("Recupero metadati PDF: {}", pdf_path)
             
-            # Apri il PDF
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = pypdf.PdfReader(file)
+            # Apri il PDF, o riusa il reader fornito dal chiamante
+            with _open_pdf(pdf_path, pdf_reader) as pdf_reader:
                 
                 # Ottieni metadati
                 metadata = pdf_reader.metadata
                 
                 # Converti in dizionario
                 if metadata:
-                    metadata_dict = {
-                        "title": metadata.get("/Title", ""),
-                        "author": metadata.get("/Author", ""),
-                        "subject": metadata.get("/Subject", ""),
-                        "creator": metadata.get("/Creator", ""),
-                        "producer": metadata.get("/Producer", ""),
-                        "creation_date": metadata.get("/CreationDate", ""),
-                        "modification_date": metadata.get("/ModDate", "")
-                    }
+                    metadata_dict = {name: metadata.get(key, "") for name, key in PDF_METADATA_FIELDS}
                 else:
                     metadata_dict = {}
                 
+                # pypdf costruisce la lista virtuale delle pagine ad ogni accesso: leggila una volta
+                pages = pdf_reader.pages
+                
                 # Aggiungi informazioni sulle pagine
-                metadata_dict["page_count"] = len(pdf_reader.pages)
+                metadata_dict["page_count"] = len(pages)
                 
-                # Aggiungi dimensioni delle pagine
+                # Aggiungi dimensioni delle prime pagine
                 page_sizes = []
-                for page_num in range(min(3, len(pdf_reader.pages))):
-                    page = pdf_reader.pages[page_num]
-                    width = page.mediabox.width
-                    height = page.mediabox.height
-                    page_sizes.append({"width": width, "height": height})
+                for page in islice(pages, 3):
+                    mediabox = page.mediabox
+                    page_sizes.append({"width": mediabox.width, "height": mediabox.height})
                 
                 metadata_dict["page_sizes"] = page_sizes
                 
-                logger.info(f"Metadati PDF recuperati: {pdf_path}")
+                logger.info("Metadati PDF recuperati: {}", pdf_path)
                 return metadata_dict
         except Exception as e:
-            logger.error(f"Errore durante il recupero dei metadati del PDF {pdf_path}: {e}")
+            logger.error("Errore durante il recupero dei metadati del PDF {}: {}", pdf_path, e)
             return {"error": str(e)}
     
+    def _ocr_page(self, page: int, image_path: str, page_count: int) -> Tuple[str, Dict[str, Any]]:
+        """
+        Esegue l'OCR di una pagina convertita in immagine
+        
+        Args:
+            page: Numero della pagina (da 1)
+            image_path: Percorso dell'immagine della pagina
+            page_count: Numero totale di pagine
+            
+        Returns:
+            Tupla con testo della pagina e risultati OCR
+        """
+        logger.info("OCR sulla pagina {}/{}: {}", page, page_count, image_path)
+        
+        # Processa l'immagine
+        page_text, page_analysis = self.image_processor.process_image(image_path)
+        
+        # Elimina l'immagine temporanea
+        os.remove(image_path)
+        
+        return page_text, {
+            "page": page,
+            "confidence": page_analysis["ocr_data"]["confidence"],
+            "words_count": page_analysis["ocr_data"]["words_count"]
+        }
+    
     def process_pdf(self, pdf_path: str) -> Tuple[str, Dict[str, Any]]:
         """
         Processa un PDF ed estrae testo e informazioni
@@ -185,42 +250,45 @@ class PDFProcessor:
             Tupla con testo estratto e informazioni sul PDF
         """
         try:
-            logger.info(f"Processamento PDF: {pdf_path}")
-            
-            # Ottieni metadati
-            metadata = self.get_pdf_metadata(pdf_path)
-            
-            # Verifica se il PDF è ricercabile
-            is_searchable = self.is_searchable_pdf(pdf_path)
+            logger.info("Processamento PDF: {}", pdf_path)
             
             text = ""
             ocr_results = []
             
-            if is_searchable:
-                # Estrai testo direttamente dal PDF
-                text = self.extract_text_from_pdf(pdf_path)
-            else:
+            # Apri e analizza il PDF una sola volta per metadati, verifica ed estrazione del testo
+            with open(pdf_path, 'rb') as file:
+                pdf_reader = pypdf.PdfReader(file)
+                
+                # Ottieni metadati
+                metadata = self.get_pdf_metadata(pdf_path, pdf_reader)
+                
+                # Verifica se il PDF è ricercabile
+                is_searchable = self.is_searchable_pdf(pdf_path, pdf_reader)
+                
+                if is_searchable:
+                    # Estrai testo direttamente dal PDF
+                    text = self.extract_text_from_pdf(pdf_path, pdf_reader)
+            
+            if not is_searchable:
                 # Converti PDF in immagini e esegui OCR
                 images = self.convert_pdf_to_images(pdf_path)
                 
-                # Processa ogni immagine
+                # Processa le pagine in parallelo: tesseract gira in un sottoprocesso
+                # e rilascia il GIL, map mantiene l'ordine delle pagine
                 page_texts = []
-                for idx, image_path in enumerate(images):
-                    logger.info(f"OCR sulla pagina {idx+1}/{len(images)}: {image_path}")
-                    
-                    # Processa l'immagine
-                    page_text, page_analysis = self.image_processor.process_image(image_path)
-                    page_texts.append(page_text)
-                    
-                    # Aggiungi risultati OCR
-                    ocr_results.append({
-                        "page": idx + 1,
-                        "confidence": page_analysis["ocr_data"]["confidence"],
-                        "words_count": page_analysis["ocr_data"]["words_count"]
-                    })
-                    
-                    # Elimina l'immagine temporanea
-                    os.remove(image_path)
+                page_count = len(images)
+                if page_count:
+                    workers = min(_ocr_page_workers, page_count)
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        pages = executor.map(
+                            self._ocr_page,
+                            range(1, page_count + 1),
+                            images,
+                            repeat(page_count)
+                        )
+                        for page_text, page_result in pages:
+                            page_texts.append(page_text)
+                            ocr_results.append(page_result)
                 
                 # Combina il testo di tutte le pagine
                 text = "\n\n".join(page_texts)
@@ -234,8 +302,8 @@ class PDFProcessor:
                 "ocr_results": ocr_results if ocr_results else None
             }
             
-            logger.info(f"Processamento PDF completato: {pdf_path}, {len(text)} caratteri estratti")
+            logger.info("Processamento PDF completato: {}, {} caratteri estratti", pdf_path, len(text))
             return text, results
         except Exception as e:
-            logger.error(f"Errore durante il processamento del PDF {pdf_path}: {e}")
+            logger.error("Errore durante il processamento del PDF {}: {}", pdf_path, e)
             return "", {"error": str(e)}
@@ -1,31 +1,37 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 
-class HealthResponse(BaseModel):
+class BaseResponse(BaseModel):
+    """Campi comuni a tutte le risposte dell'API"""
+    # Risposte immutabili e senza campi extra: nessuna validazione su assegnazione
+    model_config = ConfigDict(frozen=True, extra="forbid", validate_default=False)
+    
+    status: str = "success"
+    timestamp: datetime = Field(default_factory=datetime.now)
+
+
+class HealthResponse(BaseResponse):
     """Risposta per l'endpoint /health"""
     status: str = "ok"
-    timestamp: datetime = Field(default_factory=datetime.now)
     version: str
     environment: str
+    worker_pid: Optional[int] = None
     api_connections: Dict[str, bool]
     uptime_seconds: int
 
 
-class ErrorResponse(BaseModel):
+class ErrorResponse(BaseResponse):
     """Risposta di errore standard"""
     status: str = "error"
     error_code: str
     message: str
-    timestamp: datetime = Field(default_factory=datetime.now)
     details: Optional[Dict[str, Any]] = None
 
 
-class ProcessDocumentResponse(BaseModel):
+class ProcessDocumentResponse(BaseResponse):
     """Risposta per l'endpoint /process-document"""
-    status: str = "success"
-    timestamp: datetime = Field(default_factory=datetime.now)
     document_id: str
     document_type: str
     confidence_score: float
@@ -34,10 +40,8 @@ class ProcessDocumentResponse(BaseModel):
     processing_notes: List[str] = []
 
 
-class WebhookTestResponse(BaseModel):
+class WebhookTestResponse(BaseResponse):
     """Risposta per l'endpoint /test-webhook"""
-    status: str = "success"
-    timestamp: datetime = Field(default_factory=datetime.now)
     webhook_received: bool
     payload_valid: bool
     simulated_processing_time_ms: int
@@ -1,6 +1,6 @@
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from functools import lru_cache
 from typing import Optional
-import os
 from enum import Enum
 
 
@@ -26,9 +26,11 @@ class Settings(BaseSettings):
     MAX_FILE_SIZE_MB: int = 10
     ALLOWED_IMAGE_EXTENSIONS: list[str] = ["jpg", "jpeg", "png", "webp"]
     ALLOWED_PDF_EXTENSIONS: list[str] = ["pdf"]
+    UPLOAD_CHUNK_SIZE: int = 64 * 1024  # Buffer di lettura/scrittura degli upload in byte
     
     # Logging
     LOG_LEVEL: str = "INFO"
+    SLOW_REQUEST_THRESHOLD_MS: int = 1000  # Soglia oltre la quale una richiesta viene segnalata come lenta
     
     # Cartella temporanea per file
     TEMP_FOLDER: str = "/tmp/railway-document-worker"
@@ -36,21 +38,51 @@ class Settings(BaseSettings):
     # Configurazione OCR
     OCR_LANGUAGE: str = "ita+eng"  # Default italiano + inglese
     
+    # Worker uvicorn (la stessa variabile letta da uvicorn e dagli script di avvio)
+    WEB_CONCURRENCY: int = 1
+    
+    # Processi per OCR ed estrazione PDF di ciascun worker uvicorn
+    # (None = CPU disponibili nel container divise per WEB_CONCURRENCY, almeno 1).
+    # I processi totali sono WEB_CONCURRENCY * (1 + PROCESS_POOL_WORKERS), e ognuno
+    # dei processi del pool esegue fino a PDF_OCR_PAGE_WORKERS OCR tesseract alla volta
+    PROCESS_POOL_WORKERS: Optional[int] = None
+    
+    # Pagine di un PDF scansionato elaborate in parallelo da ciascun processo del pool
+    # (None = CPU rimaste dopo worker e pool, di solito 1 con il pool di default)
+    PDF_OCR_PAGE_WORKERS: Optional[int] = None
+    
     # Configurazione LLM
     LLM_MODEL: str = "mistralai/mistral-large-latest"  # Modello Mistral per analisi
     LLM_TIMEOUT: int = 60  # Timeout in secondi
+    LLM_MAX_CONCURRENT_REQUESTS: int = 20  # Richieste contemporanee verso l'API LLM per worker
+    LLM_MAX_DOCUMENT_CHARS: int = 8000  # Caratteri del documento inviati all'LLM, dopo la normalizzazione degli spazi
+    LLM_CACHE_MAX_ENTRIES: int = 256  # Risposte LLM conservate in memoria per worker (0 = cache disattivata)
+    LLM_CACHE_TTL_SECONDS: int = 3600  # Validità di una risposta in cache
     
     # Parametri JSON
     JSON_OUTPUT_INDENT: int = 2
     
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
-        case_sensitive = True
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        case_sensitive=True,
+        frozen=True  # Configurazione immutabile dopo il caricamento
+    )
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Restituisce l'unica istanza delle impostazioni, caricata al primo accesso"""
+    return Settings()
 
 
 # Carica le impostazioni
-settings = Settings()
+settings = get_settings()
+
+# Limite dimensione file in byte, per un confronto intero senza conversioni
+MAX_FILE_SIZE_BYTES = settings.MAX_FILE_SIZE_MB * 1024 * 1024
 
-# Crea cartella temporanea se non esiste
-os.makedirs(settings.TEMP_FOLDER, exist_ok=True)
+# Estensioni consentite come frozenset, per controlli di appartenenza O(1)
+IMAGE_EXTENSIONS = frozenset(settings.ALLOWED_IMAGE_EXTENSIONS)
+PDF_EXTENSIONS = frozenset(settings.ALLOWED_PDF_EXTENSIONS)
+ALLOWED_EXTENSIONS = IMAGE_EXTENSIONS | PDF_EXTENSIONS
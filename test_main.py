@@ -1,10 +1,26 @@
 import os
 import json
+import asyncio
+import hashlib
+import tempfile
+import orjson
 import pytest
+from fastapi import UploadFile
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 from app.main import app
+from app.config.settings import MAX_FILE_SIZE_BYTES
+from app.utils import cpu_utils
+from app.utils.file_utils import (
+    FileTooLargeError,
+    save_upload_file,
+    schedule_temp_file_cleanup,
+    start_cleanup_worker,
+    stop_cleanup_worker
+)
+from app.services.llm_cache import LLMCache
+from app.services.llm_service import LLMService, _truncate_document_text
 from app.models.document import DocumentType, DocumentProcessingResult, DocumentMetadata, FileType
 
 
@@ -108,6 +124,340 @@ async def test_process_document(mock_document_processor, test_pdf_file):
             mock_document_processor.process_document.assert_called_once()
 
 
+def test_process_document_rejects_oversized_content_length():
+    """Test del rifiuto anticipato di upload troppo grandi"""
+    response = client.post(
+        "/process-document",
+        content=b"",
+        headers={"content-length": str(100 * 1024 * 1024), "content-type": "multipart/form-data; boundary=x"}
+    )
+    
+    assert response.status_code == 413
+    data = response.json()
+    assert data["status"] == "error"
+    assert data["error_code"] == "file_too_large"
+
+
+def test_process_document_rejects_oversized_file():
+    """Test del rifiuto di un file oltre il limite ma entro il margine del Content-Length"""
+    response = client.post(
+        "/process-document",
+        files={"file": ("big.pdf", b"0" * (MAX_FILE_SIZE_BYTES + 1), "application/pdf")}
+    )
+    
+    # Stessa forma della risposta del controllo anticipato sul Content-Length
+    assert response.status_code == 413
+    data = response.json()
+    assert data["status"] == "error"
+    assert data["error_code"] == "file_too_large"
+
+
+def test_oversized_content_length_has_cors_headers():
+    """Test degli header CORS sulla risposta 413 anticipata"""
+    response = client.post(
+        "/process-document",
+        content=b"",
+        headers={
+            "origin": "https://example.com",
+            "content-length": str(100 * 1024 * 1024),
+            "content-type": "multipart/form-data; boundary=x"
+        }
+    )
+    
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "https://example.com"
+
+
+def test_available_cpus_respects_cgroup_quota(tmp_path):
+    """Test del limite di CPU letto dalla quota cgroup v2"""
+    cpu_max = tmp_path / "cpu.max"
+    cpu_max.write_text("100000 100000\n")
+    
+    with patch.object(cpu_utils, "_CGROUP_V2_CPU_MAX", cpu_max):
+        assert cpu_utils.available_cpus() == 1
+        
+        # Nessuna quota: restano le CPU assegnate al processo
+        cpu_max.write_text("max 100000\n")
+        assert cpu_utils.available_cpus() >= 1
+
+
+@pytest.mark.asyncio
+async def test_stop_cleanup_worker_drains_queue(tmp_path):
+    """Test dell'eliminazione dei file ancora in coda all'arresto del worker di pulizia"""
+    file_paths = []
+    for i in range(100):
+        file_path = tmp_path / f"{i}.tmp"
+        file_path.write_bytes(b"x")
+        file_paths.append(file_path)
+    
+    start_cleanup_worker()
+    for file_path in file_paths:
+        schedule_temp_file_cleanup(str(file_path))
+    await stop_cleanup_worker()
+    
+    assert not any(file_path.exists() for file_path in file_paths)
+
+
+def test_cors_preflight():
+    """Test della risposta di preflight CORS"""
+    response = client.options(
+        "/process-document",
+        headers={
+            "origin": "https://example.com",
+            "access-control-request-method": "POST",
+            "access-control-request-headers": "content-type, x-request-id"
+        }
+    )
+    
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == "https://example.com"
+    assert response.headers["access-control-allow-credentials"] == "true"
+    assert "POST" in response.headers["access-control-allow-methods"]
+    assert response.headers["access-control-allow-headers"] == "content-type, x-request-id"
+    assert response.headers["access-control-max-age"] == "600"
+    assert response.headers["vary"] == "Origin"
+
+
+def test_cors_simple_request():
+    """Test degli header CORS su una richiesta semplice con Origin"""
+    response = client.get("/health", headers={"origin": "https://example.com"})
+    
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == "https://example.com"
+    assert response.headers["access-control-allow-credentials"] == "true"
+    assert "Origin" in response.headers["vary"]
+    assert "access-control-allow-methods" not in response.headers
+
+
+def test_cors_without_origin():
+    """Test dell'assenza di header CORS su una richiesta senza Origin"""
+    response = client.get("/health")
+    
+    assert response.status_code == 200
+    assert not any(name.startswith("access-control-") for name in response.headers)
+    assert "Origin" not in response.headers.get("vary", "")
+
+
+def _spooled_upload(content: bytes, max_size: int = 1024 * 1024) -> UploadFile:
+    """Crea un UploadFile sopra uno SpooledTemporaryFile, come fa Starlette"""
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+    spool.write(content)
+    spool.seek(0)
+    return UploadFile(file=spool, filename="upload.pdf")
+
+
+@pytest.mark.asyncio
+async def test_save_upload_file_rolled_to_disk():
+    """Test del salvataggio di un upload oltre 1MB, già riversato su disco (sendfile)"""
+    content = os.urandom(3 * 1024 * 1024 + 123)
+    upload = _spooled_upload(content)
+    assert upload.file._rolled
+    
+    file_path, md5_hash, file_size = await save_upload_file(upload)
+    try:
+        assert file_size == len(content)
+        assert md5_hash == hashlib.md5(content).hexdigest()
+        with open(file_path, "rb") as f:
+            assert f.read() == content
+    finally:
+        os.remove(file_path)
+        await upload.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_size", [1024 * 1024, MAX_FILE_SIZE_BYTES * 2])
+async def test_save_upload_file_too_large(max_size):
+    """Test del rifiuto di un upload oltre MAX_FILE_SIZE_BYTES, su disco e in memoria"""
+    upload = _spooled_upload(b"0" * (MAX_FILE_SIZE_BYTES + 1), max_size=max_size)
+    
+    with pytest.raises(FileTooLargeError) as exc_info:
+        await save_upload_file(upload)
+    await upload.close()
+    
+    assert exc_info.value.status_code == 413
+
+
+def test_llm_cache_ttl_expiry():
+    """Test della scadenza delle risposte in cache"""
+    cache = LLMCache(max_entries=10, ttl_seconds=60)
+    
+    with patch("app.services.llm_cache.time.monotonic") as monotonic:
+        monotonic.return_value = 1000.0
+        cache.set("a", {"value": 1})
+        
+        monotonic.return_value = 1059.0
+        assert cache.get("a") == {"value": 1}
+        
+        monotonic.return_value = 1060.0
+        assert cache.get("a") is None
+    
+    assert cache.stats == {"hits": 1, "misses": 1}
+    assert len(cache._entries) == 0
+
+
+def test_llm_cache_lru_eviction():
+    """Test dell'eliminazione della risposta usata meno di recente oltre il limite"""
+    cache = LLMCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", {"value": 1})
+    cache.set("b", {"value": 2})
+    
+    # La lettura rende "a" la più recente: al prossimo inserimento esce "b"
+    assert cache.get("a") is not None
+    cache.set("c", {"value": 3})
+    
+    assert cache.get("b") is None
+    assert cache.get("a") == {"value": 1}
+    assert cache.get("c") == {"value": 3}
+
+
+def test_llm_cache_disabled():
+    """Test della cache disattivata con max_entries=0"""
+    cache = LLMCache(max_entries=0, ttl_seconds=60)
+    cache.set("a", {"value": 1})
+    
+    assert cache.get("a") is None
+    assert len(cache._entries) == 0
+
+
+def test_truncate_document_text_line_boundary():
+    """Test del taglio a fine riga entro il budget"""
+    text = "a" * 90 + "\n" + "b" * 50
+    assert _truncate_document_text(text, 100) == "a" * 90
+
+
+def test_truncate_document_text_word_boundary():
+    """Test del taglio a fine parola quando la riga finirebbe troppo presto"""
+    text = "a" * 10 + "\n" + "b" * 80 + " " + "c" * 50
+    assert _truncate_document_text(text, 100) == "a" * 10 + "\n" + "b" * 80
+
+
+def test_truncate_document_text_keeps_four_fifths():
+    """Test del taglio al limite quando l'unico spazio è all'inizio del testo"""
+    text = "a " + "x" * 10000
+    truncated = _truncate_document_text(text, 8000)
+    assert len(truncated) == 8000
+    assert truncated == text[:8000]
+
+
+def test_truncate_document_text_within_budget():
+    """Test del testo restituito intatto entro il budget"""
+    assert _truncate_document_text("testo breve", 100) == "testo breve"
+
+
+def _llm_response(content: str) -> MagicMock:
+    """Risposta HTTP fittizia di chat/completions con il contenuto indicato"""
+    response = MagicMock()
+    response.content = orjson.dumps({"choices": [{"message": {"content": content}}]})
+    return response
+
+
+@pytest.fixture
+def llm_service():
+    """Servizio LLM con una cache vuota, senza chiamate di rete"""
+    return LLMService()
+
+
+@pytest.mark.asyncio
+async def test_llm_invalid_content_not_cached(llm_service):
+    """Test del mancato salvataggio in cache di una risposta con contenuto non JSON"""
+    llm_service._client.post = AsyncMock(side_effect=[
+        _llm_response("non è JSON"),
+        _llm_response('{"document_type": "fattura"}')
+    ])
+    
+    # Primo tentativo: contenuto non valido, risultato di fallback
+    analysis = await llm_service.analyze_document_text("Fattura n. 1")
+    assert "error" in analysis
+    
+    # La richiesta identica viene rinviata invece di riusare la risposta non valida
+    analysis = await llm_service.analyze_document_text("Fattura n. 1")
+    assert analysis["document_type"] == "fattura"
+    
+    # La risposta valida è in cache: nessun altro invio
+    analysis = await llm_service.analyze_document_text("Fattura n. 1")
+    assert analysis["document_type"] == "fattura"
+    assert llm_service._client.post.await_count == 2
+
+
+def _gated_post(started: asyncio.Event, release: asyncio.Event, content: str = '{"document_type": "fattura"}'):
+    """post fittizio che segnala l'invio e risponde solo dopo release"""
+    async def post(*args, **kwargs):
+        started.set()
+        await release.wait()
+        return _llm_response(content)
+    return AsyncMock(side_effect=post)
+
+
+@pytest.mark.asyncio
+async def test_llm_identical_concurrent_calls_share_one_request(llm_service):
+    """Test di due chiamate identiche concorrenti servite da un solo invio HTTP"""
+    started, release = asyncio.Event(), asyncio.Event()
+    llm_service._client.post = _gated_post(started, release)
+    
+    first = asyncio.create_task(llm_service.call_llm_api("prompt"))
+    second = asyncio.create_task(llm_service.call_llm_api("prompt"))
+    await started.wait()
+    assert len(llm_service._inflight) == 1
+    
+    release.set()
+    first_result, second_result = await asyncio.gather(first, second)
+    
+    assert first_result == second_result
+    assert llm_service._client.post.await_count == 1
+    assert llm_service._inflight == {}
+
+
+@pytest.mark.asyncio
+async def test_llm_cancelled_waiter_does_not_cancel_shared_request(llm_service):
+    """Test dell'annullamento di una delle richieste in attesa della stessa chiamata"""
+    started, release = asyncio.Event(), asyncio.Event()
+    llm_service._client.post = _gated_post(started, release)
+    
+    first = asyncio.create_task(llm_service.call_llm_api("prompt"))
+    second = asyncio.create_task(llm_service.call_llm_api("prompt"))
+    await started.wait()
+    
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    
+    # La chiamata condivisa prosegue per la richiesta rimasta in attesa
+    release.set()
+    result = await second
+    
+    assert result["choices"][0]["message"]["content"] == '{"document_type": "fattura"}'
+    assert llm_service._client.post.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_llm_failed_shared_request_raised_to_all_waiters(llm_service):
+    """Test di un errore della chiamata condivisa, propagato a tutte le richieste in attesa"""
+    started, release = asyncio.Event(), asyncio.Event()
+    
+    async def post(*args, **kwargs):
+        started.set()
+        await release.wait()
+        raise RuntimeError("provider non disponibile")
+    
+    llm_service._client.post = AsyncMock(side_effect=post)
+    
+    first = asyncio.create_task(llm_service.call_llm_api("prompt"))
+    second = asyncio.create_task(llm_service.call_llm_api("prompt"))
+    await started.wait()
+    
+    release.set()
+    results = await asyncio.gather(first, second, return_exceptions=True)
+    
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert llm_service._client.post.await_count == 1
+    
+    # La chiamata fallita non resta tra quelle in corso: la successiva viene rinviata
+    assert llm_service._inflight == {}
+    llm_service._client.post = AsyncMock(return_value=_llm_response('{"document_type": "fattura"}'))
+    await llm_service.call_llm_api("prompt")
+    assert llm_service._client.post.await_count == 1
+
+
 @pytest.mark.asyncio
 async def test_test_webhook():
     """Test dell'endpoint di test webhook"""